@@ -1,180 +1,361 @@
 # Code based on 'Learn how to create interactive plots and intelligent dashboards with Plotly, Python,
 # and the Dash library!' From JOSE PORTILLA: https://github.com/Pierian-Data/Plotly-Dashboards-with-Dash
+#
+# Every section is a figure builder registered by name. Usage:
+#   python 0_plotly.py                 # Render all the figures that changed since the last run
+#   python 0_plotly.py heat box        # Render only some of them
+#   python 0_plotly.py --force -j 4    # Render everything again, on 4 processes
+#   python 0_plotly.py --shared-js     # One plotly.min.js next to the HTML files, instead of inlined in each of them
+# A figure is skipped when its builder code and its input CSV files did not change since its HTML was written.
+import argparse
+import base64
+import hashlib
+import inspect
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+
 import numpy as np
-import pandas as pd
+import plotly
+import plotly.io as pio
 import plotly.offline as pyo
 import plotly.graph_objs as go
-import plotly.figure_factory as ff
 from plotly.subplots import make_subplots
+from aggregate import grid_aggregate  # Long-format rows -> dense 2D grid for the heatmaps
+from distplot import create_distplot  # ff.create_distplot with a binned FFT KDE
+from data_loader import iter_chunks, load_csv, source_hash  # Parse each CSV once, then reuse the binary cache
+from figure_cache import helper_modules  # Repo modules called by a builder (aggregate, distplot, ...)
+from streaming import filter_rows, histogram_counts, reservoir_samples  # One pass over the chunks of big CSV files
+
+OUTPUT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'images')
+STAMPS_FILE = '.build_stamps.json'  # In the output dir: the stamp of each figure when it was last rendered
+PLOTLY_JS = 'plotly.min.js'  # With --shared-js: the plotly.js bundle written once in the output dir
+BINARY_MIN_SIZE = 64  # With --shared-js: numeric arrays of at least this many values are written as base64 binary
+# dtypes that plotly.js (>= 2.28) can read from base64 typed arrays. int64 is not one of them.
+BINARY_DTYPES = {'int8': 'i1', 'uint8': 'u1', 'int16': 'i2', 'uint16': 'u2', 'int32': 'i4', 'uint32': 'u4',
+                 'float32': 'f4', 'float64': 'f8'}
+FIGURES = {}  # name -> (builder, input CSV files). A builder returns {output file name: figure}
+
+
+def figure(name, *inputs):
+    """Register the decorated function as the builder of the figure 'name', which reads the CSV files 'inputs'."""
+    def register(builder):
+        FIGURES[name] = (builder, inputs)
+        return builder
+    return register
+
 
-justlast = True
 # SCATTER PLOT X and Y values  ----------------------------------------------------------------------------------
-np.random.seed(42)
-random_x = np.random.randint(1, 101, 100)  # 100 random integers from 1 to 100.
-random_y = np.random.randint(1, 101, 100)
-
-# Create the data to plot. It has to be inside a list.
-data = [go.Scatter(x=random_x, y=random_y, mode='markers',
-                   marker=dict(size=12,
-                               color='rgb(51,204,153)',  # You can either specify the color, or use define it using rgb.
-                               symbol='pentagon',
-                               line=dict(width=2)
-                               )
-                   )]
-# Create a layout to customize the plot
-layout = go.Layout(title='Hello',
-                   xaxis=dict(title='MY X AXIS'),
-                   yaxis=dict(title='MY Y AXIS'),
-                   hovermode='closest')  # mouse indicate the closest point
-# Plot without a layout
-if not justlast:
-    pyo.plot(data, filename='images/scatter_00.html')
-# Plot with a layout
-if not justlast:
+@figure('scatter')
+def scatter():
+    np.random.seed(42)
+    random_x = np.random.randint(1, 101, 100)  # 100 random integers from 1 to 100.
+    random_y = np.random.randint(1, 101, 100)
+
+    # Create the data to plot. It has to be inside a list.
+    data = [go.Scatter(x=random_x, y=random_y, mode='markers',
+                       marker=dict(size=12,
+                                   color='rgb(51,204,153)',  # You can either specify the color, or define it using rgb.
+                                   symbol='pentagon',
+                                   line=dict(width=2)
+                                   )
+                       )]
+    # Create a layout to customize the plot
+    layout = go.Layout(title='Hello',
+                       xaxis=dict(title='MY X AXIS'),
+                       yaxis=dict(title='MY Y AXIS'),
+                       hovermode='closest')  # mouse indicate the closest point
     fig = go.Figure(data=data, layout=layout)
-    pyo.plot(fig, filename='images/scatter_01.html')  # You can plot [go.Scatter] or a go.Figure
+    return {'scatter_00': data,  # Plot without a layout
+            'scatter_01': fig}  # Plot with a layout. You can plot [go.Scatter] or a go.Figure
+
 
 # Line Chart Plot X and Y values -------------------------------------------------------------------------------
-np.random.seed(56)
-x_values = np.linspace(0, 1, 100)  # 100 values from 0 to 1 equally spaced
-y_values = np.random.randn(100)
-
-# Create the data to plot
-trace0 = go.Scatter(x=x_values, y=y_values + 5, mode='markers', name='mymarkers')
-trace1 = go.Scatter(x=x_values, y=y_values, mode='lines', name='mylines')
-trace2 = go.Scatter(x=x_values, y=y_values - 5, mode='lines+markers', name='both')
-data = [trace0, trace1, trace2]
-# Create a layout
-layout = go.Layout(title='Line Chart')
-# Plot
-if not justlast:
-    fig = go.Figure(data=data, layout=layout)
-    pyo.plot(fig, filename='images/line_00.html')
-
-# Line Chart Plot from Pandas
-df = pd.read_csv('data/nst-est2017-alldata.csv')
-df2 = df[df['DIVISION'] == '1']
-df2.set_index('NAME', inplace=True)  # implace=True means that you do not have to do df2 = df2.set_index('NAME')
-list_of_pop_col = [col for col in df2.columns if col.startswith('POP')]
-df2 = df2[list_of_pop_col]
-
-data = [go.Scatter(x=df2.columns,  # X axis represents POP in each year, that is the column name (POP2018, POP2019..)
-                   y=df2.loc[name],  # Y axis is a vector with the pop value for each year (for that index, i.e. plot)
-                   mode='lines') for name in df2.index]  # Each curve is a different place (the index of df2)
-if not justlast:
-    pyo.plot(data, filename='images/line_01.html')
-
-# Exercise Line Chart
-df = pd.read_csv('data/2010YumaAZ.csv')
-days = ['MONDAY', 'TUESDAY', 'WEDNESDAY', 'THURSDAY', 'FRIDAY', 'SATURDAY', 'SUNDAY']
-data = [go.Scatter(x=df[df['DAY'] == day]['LST_TIME'],
-                   y=df[df['DAY'] == day]['T_HR_AVG'],
-                   mode='lines', name=day) for day in days]
-layout = go.Layout(title='Line Chart', xaxis=dict(title='TIME'), yaxis=dict(title='TEMPERATURE'), hovermode='closest')
-fig = go.Figure(data=data, layout=layout)
-if not justlast:
-    pyo.plot(fig, filename='images/line_02.html')
+@figure('line', 'nst-est2017-alldata.csv', '2010YumaAZ.csv')
+def line():
+    np.random.seed(56)
+    x_values = np.linspace(0, 1, 100)  # 100 values from 0 to 1 equally spaced
+    y_values = np.random.randn(100)
+
+    # Create the data to plot
+    trace0 = go.Scatter(x=x_values, y=y_values + 5, mode='markers', name='mymarkers')
+    trace1 = go.Scatter(x=x_values, y=y_values, mode='lines', name='mylines')
+    trace2 = go.Scatter(x=x_values, y=y_values - 5, mode='lines+markers', name='both')
+    data = [trace0, trace1, trace2]
+    # Create a layout
+    layout = go.Layout(title='Line Chart')
+    figures = {'line_00': go.Figure(data=data, layout=layout)}
+
+    # Line Chart Plot from Pandas. Only the NAME, DIVISION and POP* columns are read, and only the rows of the
+    # division 1 are kept: a big file is read chunk by chunk, never as a whole.
+    df2 = filter_rows(iter_chunks('nst-est2017-alldata.csv',
+                                  usecols=lambda col: col in ('NAME', 'DIVISION') or col.startswith('POP')),
+                      lambda chunk: chunk['DIVISION'] == '1')
+    df2.set_index('NAME', inplace=True)  # implace=True means that you do not have to do df2 = df2.set_index('NAME')
+    list_of_pop_col = [col for col in df2.columns if col.startswith('POP')]
+    df2 = df2[list_of_pop_col]
+
+    figures['line_01'] = [go.Scatter(x=df2.columns,  # X axis represents POP in each year, that is the column name
+                                     y=df2.loc[name],  # Y axis is a vector with the pop value for each year
+                                     mode='lines') for name in df2.index]  # Each curve is a place (the index of df2)
+
+    # Exercise Line Chart
+    df = load_csv('2010YumaAZ.csv')
+    days = ['MONDAY', 'TUESDAY', 'WEDNESDAY', 'THURSDAY', 'FRIDAY', 'SATURDAY', 'SUNDAY']
+    data = [go.Scatter(x=df[df['DAY'] == day]['LST_TIME'],
+                       y=df[df['DAY'] == day]['T_HR_AVG'],
+                       mode='lines', name=day) for day in days]
+    layout = go.Layout(title='Line Chart', xaxis=dict(title='TIME'), yaxis=dict(title='TEMPERATURE'),
+                       hovermode='closest')
+    figures['line_02'] = go.Figure(data=data, layout=layout)
+    return figures
+
 
 # BAR CHART  -------------------------------------------------------------------------------------------------
-df = pd.read_csv('data/2018WinterOlympics.csv')
-data = [go.Bar(
-    x=df['NOC'],  # NOC stands for National Olympic Committee
-    y=df['Total']
-)]
-layout = go.Layout(title='2018 Winter Olympic Medals by Country')
-fig = go.Figure(data=data, layout=layout)
-if not justlast:
-    pyo.plot(fig, filename='images/line_00.html')
-
-# More complex version
-trace1 = go.Bar(
-    x=df.sort_values(by='Gold', ascending=False)['NOC'],  # NOC stands for National Olympic Committee
-    y=df.sort_values(by='Gold', ascending=False)['Gold'],
-    name='Gold',
-    marker=dict(color='#FFD700')  # set the marker color to gold
-)
-trace2 = go.Bar(
-    x=df.sort_values(by='Gold', ascending=False)['NOC'],
-    y=df.sort_values(by='Gold', ascending=False)['Silver'],
-    name='Silver',
-    marker=dict(color='#9EA0A1')  # set the marker color to silver
-)
-trace3 = go.Bar(
-    x=df.sort_values(by='Gold', ascending=False)['NOC'],
-    y=df.sort_values(by='Gold', ascending=False)['Bronze'],
-    name='Bronze',
-    marker=dict(color='#CD7F32')  # set the marker color to bronze
-)
-data = [trace1, trace2, trace3]
-layout = go.Layout(title='2018 Winter Olympic Medals by Country',
-                   barmode='stack')
-fig = go.Figure(data=data, layout=layout)
-if not justlast:
-    pyo.plot(fig, filename='images/line_01.html')
+@figure('bar', '2018WinterOlympics.csv')
+def bar():
+    df = load_csv('2018WinterOlympics.csv')
+    data = [go.Bar(
+        x=df['NOC'],  # NOC stands for National Olympic Committee
+        y=df['Total']
+    )]
+    layout = go.Layout(title='2018 Winter Olympic Medals by Country')
+    figures = {'bar_00': go.Figure(data=data, layout=layout)}
+
+    # More complex version
+    df = df.sort_values(by='Gold', ascending=False)
+    trace1 = go.Bar(
+        x=df['NOC'],  # NOC stands for National Olympic Committee
+        y=df['Gold'],
+        name='Gold',
+        marker=dict(color='#FFD700')  # set the marker color to gold
+    )
+    trace2 = go.Bar(
+        x=df['NOC'],
+        y=df['Silver'],
+        name='Silver',
+        marker=dict(color='#9EA0A1')  # set the marker color to silver
+    )
+    trace3 = go.Bar(
+        x=df['NOC'],
+        y=df['Bronze'],
+        name='Bronze',
+        marker=dict(color='#CD7F32')  # set the marker color to bronze
+    )
+    data = [trace1, trace2, trace3]
+    layout = go.Layout(title='2018 Winter Olympic Medals by Country',
+                       barmode='stack')
+    figures['bar_01'] = go.Figure(data=data, layout=layout)
+    return figures
+
 
 # BUBBLE PLOTS  (a scatter plot where the marker size depends on a thisr variable)------------------------------------
-df = pd.read_csv('data/mpg.csv')
-data = [go.Scatter(x=df['horsepower'],
-                   y=df['mpg'],
-                   text=df['name'],  # Extra info that will appear when you pla e the mouse on a point.
-                   mode='markers',
-                   # Since the 'cylinders' variable ios small, you add a factor two to make it visible
-                   marker=dict(size=2 * df['cylinders'],
-                               color=df['weight'],
-                               showscale=True))]  # This is the part where you make the marker size variable
-layout = go.Layout(title='Bubble Chart', hovermode='closest',
-                   xaxis=dict(title='horsepower'),
-                   yaxis=dict(title='mpg'))
-fig = go.Figure(data=data, layout=layout)
-if not justlast:
-    pyo.plot(fig, filename='images/bubble_00.html')
+@figure('bubble', 'mpg.csv')
+def bubble():
+    df = load_csv('mpg.csv')
+    data = [go.Scatter(x=df['horsepower'],
+                       y=df['mpg'],
+                       text=df['name'],  # Extra info that will appear when you pla e the mouse on a point.
+                       mode='markers',
+                       # Since the 'cylinders' variable ios small, you add a factor two to make it visible
+                       marker=dict(size=2 * df['cylinders'],
+                                   color=df['weight'],
+                                   showscale=True))]  # This is the part where you make the marker size variable
+    layout = go.Layout(title='Bubble Chart', hovermode='closest',
+                       xaxis=dict(title='horsepower'),
+                       yaxis=dict(title='mpg'))
+    return {'bubble_00': go.Figure(data=data, layout=layout)}
+
 
 # BOX PLOTS --------------------------------------------------------------------------------------------------------
-df = pd.read_csv('data/abalone.csv')
-a = np.random.choice(df['rings'], 30, replace=False)
-b = np.random.choice(df['rings'], 100, replace=False)
-data = [go.Box(y=a, name='A'),
-        go.Box(y=b, name='B')]
-layout = go.Layout(title='Comparison of two samples taken from the same population')
-fig = go.Figure(data=data, layout=layout)
-if not justlast:
-    pyo.plot(fig, filename='images/box_00.html')
+@figure('box', 'abalone.csv')
+def box():
+    # Two random samples of 30 and 100 rings, drawn in one pass over the file (reservoir sampling, bounded memory).
+    # Each builder may run in its own process: seed it, so that the samples are reproducible.
+    a, b = reservoir_samples(iter_chunks('abalone.csv', usecols=['rings']), 'rings', sizes=(30, 100), seed=12)
+    data = [go.Box(y=a, name='A'),
+            go.Box(y=b, name='B')]
+    layout = go.Layout(title='Comparison of two samples taken from the same population')
+    return {'box_00': go.Figure(data=data, layout=layout)}
+
 
 # HISTOGRAMS --------------------------------------------------------------------------------------------------------
-df = pd.read_csv('data/mpg.csv')
-data = [go.Histogram(x=df['mpg'],
-                     xbins=dict(start=0, end=50, size=2))]
-layout = go.Layout(title='histograms')
-fig = go.Figure(data=data, layout=layout)
-if not justlast:
-    pyo.plot(fig, filename='images/box_00.html')
+@figure('histogram', 'mpg.csv')
+def histogram():
+    # The bins of go.Histogram(x=df['mpg'], xbins=dict(start=0, end=50, size=2)), counted while reading the file:
+    # the figure holds one bar per bin instead of every row, and the file is never loaded as a whole.
+    size = 2  # Width of the bins
+    edges, counts = histogram_counts(iter_chunks('mpg.csv', usecols=['mpg']), 'mpg', start=0, end=50, size=size)
+    data = [go.Bar(x=edges + size / 2,  # Center of the bins
+                   y=counts,
+                   width=size)]
+    layout = go.Layout(title='histograms', bargap=0)
+    return {'hist_00': go.Figure(data=data, layout=layout)}
+
 
 # DIST PLOTS --------------------------------------------------------------------------------------------------------
-df = pd.read_csv('data/iris.csv')
-trace0 = df[df['class'] == 'Iris-setosa']['petal_length']
-trace1 = df[df['class'] == 'Iris-versicolor']['petal_length']
-trace2 = df[df['class'] == 'Iris-virginica']['petal_length']
-data = [trace0, trace1, trace2]
-group_labels = ['Iris Setosa', 'Iris Versicolor', 'Iris Virginica']
-fig = ff.create_distplot(data, group_labels, bin_size=[0.1, 0.2, 0.2])
-if not justlast:
-    pyo.plot(fig, filename='images/dist_00.html')
+@figure('dist', 'iris.csv')
+def dist():
+    df = load_csv('iris.csv')
+    trace0 = df[df['class'] == 'Iris-setosa']['petal_length']
+    trace1 = df[df['class'] == 'Iris-versicolor']['petal_length']
+    trace2 = df[df['class'] == 'Iris-virginica']['petal_length']
+    data = [trace0, trace1, trace2]
+    group_labels = ['Iris Setosa', 'Iris Versicolor', 'Iris Virginica']
+    # Same figure as ff.create_distplot, but with a binned FFT KDE (cached), server-side histograms and a bounded rug
+    return {'dist_00': create_distplot(data, group_labels, bin_size=[0.1, 0.2, 0.2])}
+
 
 # HEAT MAP + SUBPLOTS------------------------------------------------------------------------------------------------
-df = pd.read_csv('data/flights.csv')
-trace1 = go.Heatmap(
-    x=df['year'],
-    y=df['month'],
-    z=df['passengers'])
-trace2 = go.Heatmap(
-    x=df['year'],
-    y=df['month'],
-    z=df['passengers'])
-fig = make_subplots(rows=1,
-                    cols=2,
-                    subplot_titles=['v1', 'v2'],
-                    shared_yaxes=True)  # Shate the same y-axis
-fig.append_trace(trace1, 1, 1)  # append the plot numnber 1 in the subplot on raw=1 and col=1
-fig.append_trace(trace2, 1, 2)
-fig['layout'].update(title='HEAT MAP')
-pyo.plot(fig, filename='images/heat_00.html')
+@figure('heat', 'flights.csv')
+def heat():
+    df = load_csv('flights.csv')
+    # Pivot the long-format rows (year, month, passengers) into a dense year x month grid on the server, once, and use
+    # the same grid in both subplots: the figure holds one value per cell, not one per row.
+    years, months, passengers = grid_aggregate(df, x='year', y='month', z='passengers', reducer='sum')
+    trace1 = go.Heatmap(
+        x=years,
+        y=months,
+        z=passengers)
+    trace2 = go.Heatmap(
+        x=years,
+        y=months,
+        z=passengers)
+    fig = make_subplots(rows=1,
+                        cols=2,
+                        subplot_titles=['v1', 'v2'],
+                        shared_yaxes=True)  # Shate the same y-axis
+    fig.append_trace(trace1, 1, 1)  # append the plot numnber 1 in the subplot on raw=1 and col=1
+    fig.append_trace(trace2, 1, 2)
+    fig['layout'].update(title='HEAT MAP')
+    return {'heat_00': fig}
+
+
+# ---------------------------------------------------- Renderer ----------------------------------------------------
+def stamp(name, shared_js=False):
+    """Hash of everything a figure depends on: the builder code, the helper modules it calls, the renderer code, the
+    input CSV files, the plotly version and the export mode."""
+    builder, inputs = FIGURES[name]
+    sha1 = hashlib.sha1(inspect.getsource(builder).encode())
+    for module in helper_modules(builder):
+        sha1.update(inspect.getsource(module).encode())
+    for function in (binary_arrays_supported, encode_arrays, write_shared_js, render):  # How the HTML is written
+        sha1.update(inspect.getsource(function).encode())
+    sha1.update(repr((PLOTLY_JS, BINARY_MIN_SIZE, BINARY_DTYPES)).encode())
+    sha1.update(plotly.__version__.encode())
+    sha1.update(b'shared-js' if shared_js else b'inline-js')
+    for filename in inputs:
+        sha1.update(source_hash(filename).encode())
+    return sha1.hexdigest()
+
+
+def binary_arrays_supported():
+    version = tuple(int(v) for v in pyo.get_plotlyjs_version().split('.')[:2])
+    return version >= (2, 28)
+
+
+def encode_arrays(value):
+    """Replace the big numeric arrays of a figure dict with plotly.js base64 typed arrays ({'dtype', 'bdata'})."""
+    if isinstance(value, dict):
+        return {key: encode_arrays(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        if len(value) < BINARY_MIN_SIZE or not all(isinstance(v, (int, float)) and not isinstance(v, bool)
+                                                   for v in value):
+            return [encode_arrays(item) for item in value]
+        value = np.asarray(value)
+    if isinstance(value, np.ndarray):
+        if value.size < BINARY_MIN_SIZE or value.dtype.kind not in 'iuf':
+            return value
+        if value.dtype.kind in 'iu' and value.dtype.itemsize == 8:  # No 64-bit integers in plotly.js
+            fits = value.size == 0 or (np.iinfo(np.int32).min <= value.min() and value.max() <= np.iinfo(np.int32).max)
+            value = value.astype(np.int32 if fits else np.float64)
+        value = np.ascontiguousarray(value, dtype=value.dtype.newbyteorder('<'))
+        encoded = {'dtype': BINARY_DTYPES[value.dtype.name], 'bdata': base64.b64encode(value.tobytes()).decode()}
+        if value.ndim > 1:
+            encoded['shape'] = ', '.join(str(n) for n in value.shape)
+        return encoded
+    return value
+
+
+def write_shared_js(output_dir):
+    """Write the plotly.js bundle in output_dir, unless the same one is already there."""
+    path = os.path.join(output_dir, PLOTLY_JS)
+    bundle = pyo.get_plotlyjs()
+    try:
+        with open(path, encoding='utf-8') as f:
+            if f.read() == bundle:
+                return
+    except OSError:
+        pass
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(bundle)
+
+
+def render(name, output_dir, shared_js=False):
+    """Build the figure 'name' and write its HTML files. Returns the names of the written files.
+
+    With shared_js the HTML files only contain the figure JSON (big arrays as base64 binary) and load plotly.js from
+    the plotly.min.js file next to them: no CDN is needed, so the files work offline.
+    """
+    builder, _ = FIGURES[name]
+    outputs = []
+    for output_name, fig in builder().items():
+        filename = os.path.join(output_dir, output_name + '.html')
+        if shared_js:
+            fig = fig.to_plotly_json() if isinstance(fig, go.Figure) else go.Figure(data=fig).to_plotly_json()
+            if binary_arrays_supported():
+                fig = encode_arrays(fig)
+            pio.write_html(fig, filename, include_plotlyjs=PLOTLY_JS, validate=False)
+        else:
+            pyo.plot(fig, filename=filename, auto_open=False)
+        outputs.append(output_name + '.html')
+    return outputs
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Render the plotly examples as HTML files.')
+    parser.add_argument('names', nargs='*', metavar='name',
+                        help='Figures to render (default: all of them): ' + ', '.join(FIGURES))
+    parser.add_argument('-j', '--jobs', type=int, default=os.cpu_count(), help='Number of processes')
+    parser.add_argument('-f', '--force', action='store_true', help='Render even the figures that did not change')
+    parser.add_argument('-o', '--output-dir', default=OUTPUT_DIR)
+    parser.add_argument('--shared-js', action='store_true',
+                        help=f'Write plotly.js once as {PLOTLY_JS} and reference it from every HTML file')
+    args = parser.parse_args()
+    unknown = [name for name in args.names if name not in FIGURES]
+    if unknown:
+        parser.error('unknown figure(s): ' + ', '.join(unknown))
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    stamps_path = os.path.join(args.output_dir, STAMPS_FILE)
+    try:
+        with open(stamps_path) as f:
+            stamps = json.load(f)
+    except (OSError, ValueError):
+        stamps = {}
+
+    todo = {}  # name -> new stamp, for the figures to render
+    for name in args.names or FIGURES:
+        previous = stamps.get(name, {})
+        new_stamp = stamp(name, args.shared_js)
+        up_to_date = previous.get('stamp') == new_stamp and all(
+            os.path.exists(os.path.join(args.output_dir, output)) for output in previous.get('outputs', []))
+        if up_to_date and not args.force:
+            print(f'{name}: up to date')
+        else:
+            todo[name] = new_stamp
+
+    if args.shared_js:
+        write_shared_js(args.output_dir)
+    if todo:
+        with ProcessPoolExecutor(max_workers=max(1, min(args.jobs, len(todo)))) as pool:
+            results = {name: pool.submit(render, name, args.output_dir, args.shared_js) for name in todo}
+            for name, result in results.items():
+                stamps[name] = {'stamp': todo[name], 'outputs': result.result()}
+                print(f'{name}: ' + ', '.join(stamps[name]['outputs']))
+        with open(stamps_path, 'w') as f:
+            json.dump(stamps, f, indent=1, sort_keys=True)
+
+
+if __name__ == '__main__':
+    main()
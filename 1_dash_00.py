@@ -4,12 +4,33 @@ import pandas as pd
 import numpy as np
 import plotly.graph_objs as go
 import dash
-import dash_core_components as dcc  # Describes the individual graph (it can be also a button or a table)
-import dash_html_components as html  # Describes the layout of the page
+try:  # Dash >= 2 ships the components (the dash_core_components/dash_html_components packages are deprecated)
+    from dash import dcc, html
+except ImportError:
+    import dash_core_components as dcc  # Describes the individual graph (it can be also a button or a table)
+    import dash_html_components as html  # Describes the layout of the page
 from dash.dependencies import Input, Output, State  # For callback interactivity (will be used by the decorators)
-import dash_auth
+from dash.exceptions import PreventUpdate  # Raised by a callback to leave its Output unchanged
+from credentials import CredentialStore, SessionBasicAuth  # dash_auth.BasicAuth with hashed passwords
 # import requests  # To perform web-scraping
-import base64  # In order to import an image
+import functools
+import os
+from data_loader import load_csv  # Parse each CSV once, then reuse the binary cache in data/.cache/
+from figure_cache import prebuilt_figure  # Static figures saved once as plain-dict JSON
+from image_cache import ImageCache, StaticImages  # In order to import an image
+try:  # flask-caching is optional: callback results shared between processes
+    from flask_caching import Cache
+except ImportError:
+    Cache = None
+try:  # flask-compress is optional: brotli/gzip compression of the responses
+    from flask_compress import Compress
+except ImportError:
+    Compress = None
+from live_stream import SQLiteSource  # Append-only source of the live chart
+from metrics import CallbackMetrics  # Use @metrics.callback instead of @app.callback
+from selection import SelectionEngine  # Points inside a Box/Lasso selection
+# Plain-dict traces (no go validation at every call): scatter, or scattergl + downsampling if big
+from traces import axis_window, needs_downsampling, plain_trace, scatter_trace
 
 # ---------------------------------------------------- Input Data ----------------------------------------------------
 # HEX color dictionary (for your convenience)
@@ -24,17 +45,29 @@ markdown_text = """
     * [Mark-down guide](https://www.markdownguide.org/basic-syntax/)
 """
 # Get a df for inserting the plot later on
-df = pd.read_csv('data/gapminderDataFiveYear.csv')
+df = load_csv('gapminderDataFiveYear.csv')
 year_options = []  # The Dropdown menu will show all possible years. You select a year, it returns it as a float.
 for year in df['year'].unique():
     year_options.append({'label': str(year), 'value': year})
+# Partition index built once: (year, continent) -> (gdpPercap, lifeExp) arrays, so that the year-picker callback
+# only looks up ready-made arrays instead of filtering the whole df at every change.
+continents = df['continent'].unique()
+gapminder_index = {(year, continent): (group['gdpPercap'].to_numpy(), group['lifeExp'].to_numpy())
+                   for (year, continent), group in df.groupby(['year', 'continent'], sort=False)}
+# Size of the largest trace of each year: the zoom only changes the figure if that trace is downsampled
+gapminder_max_points = df.groupby(['year', 'continent']).size().groupby(level='year').max().to_dict()
+empty = np.array([])
+FIGURE_CACHE_SIZE = 16  # How many per-year figures are kept in memory
 # Get another df for another plot (a plot with 2 inputs)
-df2 = pd.read_csv('data/mpg.csv')
+df2 = load_csv('mpg.csv')
 df2['year'] = np.random.randint(-4, 5, len(df2)) * 0.1 + df2[
     'model_year']  # Year is alway a multiple of 10. This fix it.
 features = df2.columns
+# Aligned per-row arrays of df2 for the mpg hover callbacks: a hover only costs one index lookup per column
+mpg_records = {column: df2[column].to_numpy() for column in ('name', 'cylinders', 'displacement', 'acceleration')}
+max_speed = 60 / df2['acceleration'].min()  # Range of the mpg-line y axis, computed once
 # Get another df for another plot (multiple inputs/outputs)
-df3 = pd.read_csv('data/wheels.csv')
+df3 = load_csv('wheels.csv')
 # Scatter plot data for Selection Data
 np.random.seed(10)
 x1 = np.linspace(0.1, 5, 50)
@@ -44,307 +77,524 @@ dfx1 = pd.DataFrame({'x': x1, 'y': y})
 dfx2 = pd.DataFrame({'x': x1, 'y': y})
 dfx3 = pd.DataFrame({'x': x2, 'y': y})
 dfx = pd.concat([dfx1, dfx2, dfx3])
+selection_engine = SelectionEngine(dfx['x'], dfx['y'])  # Index of the points of dfx, for the Box/Lasso selections
+
+
+# (wheels, color) -> image file, built once instead of scanning df3 with a boolean mask at every callback
+wheel_images = {(wheels, color): image for wheels, color, image in zip(df3['wheels'], df3['color'], df3['image'])}
+IMAGE_PATH = 'data/Images/'
+image_cache = ImageCache(max_bytes=4 * 1024 * 1024)  # Encoded images kept in memory (at most 4 MB)
+# 'url': the callbacks return the URL of a static route (cacheable by the browser, optional 300px thumbnails).
+# 'inline': the callbacks return the whole image as a base64 data URI.
+IMAGE_MODE = 'url'
 
 
 # Encode an image to add into the dashboard
 def encode_image(image_file):
-    encoded = base64.b64encode(open(image_file, 'rb').read())  # Read and image and encode it into a binary file.
-    return 'data:image/png;base64,{}'.format(encoded.decode())  # This string is how html file can add an image.
+    return image_cache.get(image_file)  # Encoded once, then served from the cache until the file changes
+
+
+# The image (URL or data URI) to put in the 'src' of an html.Img
+def image_src(image_name):
+    if IMAGE_MODE == 'url':
+        return static_images.url(image_name)
+    return encode_image(IMAGE_PATH + image_name)
 
 
 # -----------------------------------    Start a Dash application    --------------------------------------------
 # NOTE: You can print on the stdout the help menu for each method of dash
 # print(help(html.Div))
 # print(help(html.H1))
-app = dash.Dash()
+app = dash.Dash(__name__)  # Without a name, Dash inspects the whole call stack to find it (slow at startup)
+# Compress the responses bigger than COMPRESS_MIN_BYTES (figures, layout, JavaScript bundles) with brotli or gzip,
+# whichever the browser accepts. The smaller ones (most callbacks) are not worth the CPU time. Registered before the
+# metrics, so that /metrics still counts the uncompressed bytes.
+COMPRESS_MIN_BYTES = 1400  # About one TCP packet
+if Compress is not None:
+    app.server.config.update(COMPRESS_ALGORITHM=['br', 'gzip'], COMPRESS_MIN_SIZE=COMPRESS_MIN_BYTES)
+    Compress(app.server)
 # Let's protect this dashboard
 # HTTP Authorization: free protocol to protect a dashboard. You store username-password in the code, but you have to
 #                     take care yourself of securely distribute those username-password to the users.
 # Plotly OAuth: authentication is mantained by Plotly, but you have to pay a subscription
-USERNAME_PWD = [['user1', '123'], ['user2', '456']]
-auth = dash_auth.BasicAuth(app, USERNAME_PWD)
+# Here the passwords are not in the code: credentials.txt keeps their scrypt hashes (the demo users are user1/123 and
+# user2/456, add or replace users with 'python credentials.py USERNAME'). The file is reloaded when it changes. The
+# slow password check runs once per browser session, then a token in the signed session cookie is enough.
+CREDENTIALS_FILE = os.environ.get('DASH_CREDENTIALS', 'credentials.txt')
+# A scraper does not keep the session cookie, so behind Basic auth it would pay for scrypt on every scrape: with
+# DASH_METRICS_TOKEN set, /metrics skips the password and asks for 'Authorization: Bearer <token>' instead.
+METRICS_TOKEN = os.environ.get('DASH_METRICS_TOKEN')
+auth = SessionBasicAuth(app, CredentialStore(CREDENTIALS_FILE),  # Set DASH_SECRET_KEY in production (credentials.py)
+                        public_paths=['/metrics'] if METRICS_TOKEN else ())
+# Timing, payload size and call counts of every callback: on /metrics and in the Server-Timing response header
+metrics = CallbackMetrics(app, token=METRICS_TOKEN)
+# Figures shared by all the worker processes of the WSGI server (see wsgi.py): a file cache with a TTL, bounded in
+# number of entries. Without flask-caching each process only has its own in-memory caches.
+if Cache is not None:
+    cache = Cache(app.server, config={'CACHE_TYPE': 'FileSystemCache',
+                                      'CACHE_DIR': 'data/.cache/callbacks',
+                                      'CACHE_THRESHOLD': 500,  # Maximum number of cached results
+                                      'CACHE_DEFAULT_TIMEOUT': 300})  # Seconds
+    shared_memoize = cache.memoize()
+else:
+    def shared_memoize(function):
+        return function
+# Source of the live chart: a SQLite table tailed by the Interval (python live_stream.py appends test data)
+LIVE_DB = os.environ.get('DASH_LIVE_DB', 'data/live.sqlite')
+LIVE_MAX_POINTS = 1000  # The live chart keeps only the last 1000 points
+live_source = SQLiteSource(LIVE_DB)
+# Route serving the wheel images (resized to the 300px height of the html.Img if Pillow is installed)
+static_images = StaticImages(app.server, IMAGE_PATH, url_prefix='/wheel-images', thumbnail_height=300,
+                             thumbnail_dir='data/.cache/thumbnails')
+static_images.pregenerate()
+
+# Cold start (e.g. new workers under autoscaling). With FAST_START the static figures of the layout are built once and
+# saved as plain-dict JSON (data/.cache/figures/): the next processes only load them. The layout is then served by a
+# function, called at each page load, instead of being built at import. FAST_START = False builds everything at import.
+FAST_START = True
+
+
+def static_figure(*input_csvs):
+    if FAST_START:
+        return prebuilt_figure(*input_csvs)
+    return lambda builder: builder
+
+
+@static_figure('wheels.csv')
+def wheel_figure():
+    return {'data': [go.Scatter(x=df3['color'],
+                                y=df3['wheels'],
+                                dy=1,  # Grid-line structure
+                                mode='markers',
+                                marker={'size': 15})],
+            'layout': go.Layout(title='Test',
+                                xaxis={'title': 'Color'},
+                                yaxis={'title': 'Wheels', 'nticks': 3},
+                                hovermode='closest')}
+
+
+@static_figure()  # dfx is generated with a fixed seed
+def selection_figure():
+    return {'data': [scatter_trace(x=dfx['x'],
+                                   y=dfx['y'],
+                                   mode='markers'
+                                   )],
+            'layout': go.Layout(title='Scatter Plot', hovermode='closest')}
+
+
+@static_figure('mpg.csv')
+def mpg_figure():
+    return {'data': [scatter_trace(x=df2['year'] + 1900,
+                                   y=df2['mpg'],
+                                   text=df2['name'],
+                                   hoverinfo='text + x + y',  # What to display on overData
+                                   mode='markers')],
+            'layout': go.Layout(title='MPG Data',
+                                xaxis={'title': 'Model Year'},
+                                yaxis={'title': 'MPG'},
+                                hovermode='closest')}
+
+
+@static_figure()
+def mpg_line_figure():
+    return {'data': [go.Scatter(x=[0, 1],
+                                y=[0, 1],
+                                mode='lines')],
+            'layout': go.Layout(title='acceleration',
+                                margin={'l': 0})  # Left marging=0, so this plot is next the prev one
+            }
+
 
 # Here you define the layout of your dashboard. You start with a Div: a container of spaces to use.
-app.layout = html.Div(children=[
-    # ---- Interval: this part refresh automatically the page ----
-    html.H1(id='live-text-update'),
-    dcc.Interval(id='interval-component',
-                 interval=10000,  # 10k milliseconds = 10 seconds
-                 n_intervals=0),  # You start counting the refreshes from zero
-    # ---- H1 ----- It will appear as text.
-    html.H1(
-        children='My First Dashboard',  # Text you are displaying
-        style={  # The sytyle how you dispaly it
-            'textAlign': 'center',
-            'color': colors['text'],
-            'backgroundColor': 'red',
-            'border': '3px ' + border_color + ' solid'  # Cannot use hex color
-        }
-    ),
-    # ---- DROPDOWN ----
-    html.Label(children='Cities', style={'color': colors['text']}),
-    dcc.Dropdown(options=[{'label': 'New York City', 'value': 'NYC'},
-                          {'label': 'San Francisco', 'value': 'SF'}],
-                 value='SF'),  # Default value if label ios not specified.
-    # ---- SLIDER ----
-    html.Label('Slider', style={'color': colors['text']}),
-    dcc.Slider(min=-10, max=10, step=1, value=0,
-               marks={i: i for i in range(-10, 10)}),
-    # ---- RADIO ITEMS ----
-    html.P(  # This gives a new paragraph, so that this item is not overlapped to the previous one.
-        html.Label('Radio Items', style={'color': colors['text']})
-    ),
-    dcc.RadioItems(options=[{'label': 'New York City', 'value': 'NYC'},
-                            {'label': 'San Francisco', 'value': 'SF'}],
-                   style={'color': colors['text']},
-                   value='SF'),
-    # ---- CALLBACK EXAMPLE: 1 INPUT + DIV ----
-    html.Div(children=[  # You created a Div that has and Input on the first line, and a Div on the second line.
-        dcc.Input(id='text-input', value='<insert value>', type='text'),  # Input Object, where you can write.
-        html.Button(id='submit-button',  # This time the Input will affect the Output only after submitting the input
-                    n_clicks=0,  # Variable that keep track on the number of clicks, not needed now
-                    children='Submit here',
-                    style={'fontSize': 24}),
-        html.Div(children='', id='my-div')  # This is an empy Div where you will write the output of 'update_div'.
-    ]),
-    # ---- DIV ----
-    html.Div(
-        children=['DIV - 0 (Text)',
-                  html.Div(children=['DIV - 1 (Div)'], style={'textAlign': 'center'})],
-        style={
-            'textAlign': 'center',
-            'color': colors['text']
-        }
-    ),
-    # ---- MARKDOWN
-    dcc.Markdown(children=markdown_text),
-    # ---- PLOT ----
-    dcc.Graph(
-        id='example-graph',  # Unique ID to refers to this plot.
-        figure={  # Figure object, so that you can build the plot.
-            'data': [
-                {'x': [1, 2, 3], 'y': [4, 1, 2], 'type': 'bar', 'name': 'SF'},
-                {'x': [1, 2, 3], 'y': [2, 4, 5], 'type': 'bar', 'name': u'Montréal'},
-            ],
-            'layout': {
-                'plot_bgcolor': colors['background'],
-                'paper_bgcolor': colors['background'],
-                'font': {
-                    'color': colors['text']
-                },
-                'title': 'My Plot'
+def serve_layout():
+    return html.Div(children=[
+        # ---- Interval: this part refresh automatically the page ----
+        html.H1(id='live-text-update'),
+        dcc.Interval(id='interval-component',
+                     interval=10000,  # 10k milliseconds = 10 seconds
+                     n_intervals=0),  # You start counting the refreshes from zero
+        # ---- Live chart: at every Interval tick only the new points are sent (extendData) ----
+        dcc.Graph(id='live-graph', figure={'data': [{'x': [], 'y': [], 'mode': 'lines', 'type': 'scatter'}],
+                                           'layout': {'title': 'Live data', 'xaxis': {'type': 'date'}}}),
+        dcc.Store(id='live-cursor', storage_type='memory'),  # Last row sent to this page (reset on reload)
+        # ---- H1 ----- It will appear as text.
+        html.H1(
+            children='My First Dashboard',  # Text you are displaying
+            style={  # The sytyle how you dispaly it
+                'textAlign': 'center',
+                'color': colors['text'],
+                'backgroundColor': 'red',
+                'border': '3px ' + border_color + ' solid'  # Cannot use hex color
             }
-        }
-    ),
-    # ---- INTERACTIVE PLOT ----
-    dcc.Graph(id='graph'),  # You let it blank, since the decorator will fill its output.
-    dcc.Dropdown(id='year-picker', options=year_options, value=df['year'].max()),  # Default year is the max year.
-    # ---- INTERACTIVE PLOT with 2 inputs ----
-    html.Div([dcc.Dropdown(id='xaxis',  # You place the Dropdown in a Div to custimize its individual style
-                           options=[{'label': i, 'value': i} for i in features],
-                           value='displacement')],
-             style={'width': '48%', 'display': 'inline-block'}),
-    html.Div([dcc.Dropdown(id='yaxis',
-                           options=[{'label': i, 'value': i} for i in features],
-                           value='mpg')],
-             style={'width': '48%', 'display': 'inline-block'}),
-    dcc.Graph(id='feature-graphic'),
-    # ---- Multiple INPUTs/OUTPUTs ----
-    html.Div([
-        dcc.RadioItems(id='wheels',  # Input: you can select how many wheels
-                       options=[{'lable': i, 'value': i} for i in df3['wheels'].unique()],
-                       value=1),
-        html.Div(id='wheels-output'),  # Output: text box where you read the number of wheels selected
-        html.Hr(),
-        dcc.RadioItems(id='colors',  # Input: you can select a color
-                       options=[{'lable': i, 'value': i} for i in df3['color'].unique()],
-                       value='blue'),
-        html.Div(id='colors-output'),  # Output: text box where you read the color selected
-        html.Img(id='display-img', src='children', height=300),  # The Image you will display
-    ]),
-    # ---- Hover Over Data ----
-    html.Div([
-        # Every Plot has a hoverData method that contain the info where the mouse is located.
-        html.Div(dcc.Graph(id='wheel-plot', figure={'data': [go.Scatter(x=df3['color'],
-                                                                        y=df3['wheels'],
-                                                                        dy=1,  # Grid-line structure
-                                                                        mode='markers',
-                                                                        marker={'size': 15})],
-                                                    'layout': go.Layout(title='Test',
-                                                                        xaxis={'title': 'Color'},
-                                                                        yaxis={'title': 'Wheels', 'nticks': 3},
-                                                                        hovermode='closest')},
-                           style={'width': '30%', 'float': 'left'})),  # The graph will use 30% of the space
-        # This is an image that will change depedning on the data point selected by the mount on the prev graph.
-        html.Div([html.Img(id='hover-data', src='children', height=300)],
-                 style={'paddingTop': 35})
-    ]),
-    # ---- Selection DATA (select and see operation on selected data) ----
-    html.Div([
-        html.Div([dcc.Graph(id='plot',
-                            figure={'data': [go.Scatter(x=dfx['x'],
-                                                        y=dfx['y'],
-                                                        mode='markers'
-                                                        )],
-                                    'layout': go.Layout(title='Scatter Plot', hovermode='closest')}
-                            )
-                  ], style={'width': '30%', 'display': 'inline-block'}),
-        html.Div([
-            html.H1(id='density', style={'paddingTop': 25})
-        ], style={'width': '30%', 'display': 'inline-block', 'verticalAlign': 'top'})
-    ], style={'display': 'block'}),
-    html.Div([
-        html.Div(
-            dcc.Graph(id='mpg-scatter',
-                      figure={'data': [go.Scatter(x=df2['year'] + 1900,
-                                                  y=df2['mpg'],
-                                                  text=df2['name'],
-                                                  hoverinfo='text + x + y',  # What to display on overData
-                                                  mode='markers')],
-                              'layout': go.Layout(title='MPG Data',
-                                                  xaxis={'title': 'Model Year'},
-                                                  yaxis={'title': 'MPG'},
-                                                  hovermode='closest')}
-                      ), style={'width': '50%', 'display': 'inline-block'}
         ),
+        # ---- DROPDOWN ----
+        html.Label(children='Cities', style={'color': colors['text']}),
+        dcc.Dropdown(options=[{'label': 'New York City', 'value': 'NYC'},
+                              {'label': 'San Francisco', 'value': 'SF'}],
+                     value='SF'),  # Default value if label ios not specified.
+        # ---- SLIDER ----
+        html.Label('Slider', style={'color': colors['text']}),
+        dcc.Slider(min=-10, max=10, step=1, value=0,
+                   marks={i: i for i in range(-10, 10)}),
+        # ---- RADIO ITEMS ----
+        html.P(  # This gives a new paragraph, so that this item is not overlapped to the previous one.
+            html.Label('Radio Items', style={'color': colors['text']})
+        ),
+        dcc.RadioItems(options=[{'label': 'New York City', 'value': 'NYC'},
+                                {'label': 'San Francisco', 'value': 'SF'}],
+                       style={'color': colors['text']},
+                       value='SF'),
+        # ---- CALLBACK EXAMPLE: 1 INPUT + DIV ----
+        html.Div(children=[  # You created a Div that has and Input on the first line, and a Div on the second line.
+            dcc.Input(id='text-input', value='<insert value>', type='text'),  # Input Object, where you can write.
+            html.Button(id='submit-button',  # This time the Input will affect the Output only after submitting it
+                        n_clicks=0,  # Variable that keep track on the number of clicks, not needed now
+                        children='Submit here',
+                        style={'fontSize': 24}),
+            html.Div(children='', id='my-div')  # This is an empy Div where you will write the output of 'update_div'.
+        ]),
+        # ---- DIV ----
         html.Div(
-            dcc.Graph(id='mpg-line',
-                      figure={'data': [go.Scatter(x=[0, 1],
-                                                  y=[0, 1],
-                                                  mode='lines')],
-                              'layout': go.Layout(title='acceleration',
-                                                  margin={'l': 0})  # Left marging=0, so this plot is next the prev one
-                              }), style={'width': '20%', 'height': '50%', 'display': 'inline-block'}),
-        html.Div([dcc.Markdown(id='mpg-stats')], style={'width': '20%', 'height': '50%', 'display': 'inline-block'})
-    ])
-], style={'backgroundColor': colors['background']})  # Style of the initial container you crated at the beginning
+            children=['DIV - 0 (Text)',
+                      html.Div(children=['DIV - 1 (Div)'], style={'textAlign': 'center'})],
+            style={
+                'textAlign': 'center',
+                'color': colors['text']
+            }
+        ),
+        # ---- MARKDOWN
+        dcc.Markdown(children=markdown_text),
+        # ---- PLOT ----
+        dcc.Graph(
+            id='example-graph',  # Unique ID to refers to this plot.
+            figure={  # Figure object, so that you can build the plot.
+                'data': [
+                    {'x': [1, 2, 3], 'y': [4, 1, 2], 'type': 'bar', 'name': 'SF'},
+                    {'x': [1, 2, 3], 'y': [2, 4, 5], 'type': 'bar', 'name': u'Montréal'},
+                ],
+                'layout': {
+                    'plot_bgcolor': colors['background'],
+                    'paper_bgcolor': colors['background'],
+                    'font': {
+                        'color': colors['text']
+                    },
+                    'title': 'My Plot'
+                }
+            }
+        ),
+        # ---- INTERACTIVE PLOT ----
+        dcc.Graph(id='graph'),  # You let it blank, since the decorator will fill its output.
+        dcc.Dropdown(id='year-picker', options=year_options, value=df['year'].max()),  # Default year is the max year.
+        # ---- INTERACTIVE PLOT with 2 inputs ----
+        html.Div([dcc.Dropdown(id='xaxis',  # You place the Dropdown in a Div to custimize its individual style
+                               options=[{'label': i, 'value': i} for i in features],
+                               value='displacement')],
+                 style={'width': '48%', 'display': 'inline-block'}),
+        html.Div([dcc.Dropdown(id='yaxis',
+                               options=[{'label': i, 'value': i} for i in features],
+                               value='mpg')],
+                 style={'width': '48%', 'display': 'inline-block'}),
+        dcc.Graph(id='feature-graphic'),
+        # ---- Multiple INPUTs/OUTPUTs ----
+        html.Div([
+            dcc.RadioItems(id='wheels',  # Input: you can select how many wheels
+                           options=[{'lable': i, 'value': i} for i in df3['wheels'].unique()],
+                           value=1),
+            html.Div(id='wheels-output'),  # Output: text box where you read the number of wheels selected
+            html.Hr(),
+            dcc.RadioItems(id='colors',  # Input: you can select a color
+                           options=[{'lable': i, 'value': i} for i in df3['color'].unique()],
+                           value='blue'),
+            html.Div(id='colors-output'),  # Output: text box where you read the color selected
+            html.Img(id='display-img', src='children', height=300),  # The Image you will display
+        ]),
+        # ---- Hover Over Data ----
+        html.Div([
+            # Every Plot has a hoverData method that contain the info where the mouse is located.
+            html.Div(dcc.Graph(id='wheel-plot', figure=wheel_figure(),
+                               style={'width': '30%', 'float': 'left'})),  # The graph will use 30% of the space
+            # This is an image that will change depedning on the data point selected by the mount on the prev graph.
+            html.Div([html.Img(id='hover-data', src='children', height=300)],
+                     style={'paddingTop': 35})
+        ]),
+        # ---- Selection DATA (select and see operation on selected data) ----
+        html.Div([
+            html.Div([dcc.Graph(id='plot', figure=selection_figure())],
+                     style={'width': '30%', 'display': 'inline-block'}),
+            html.Div([
+                html.H1(id='density', style={'paddingTop': 25}),
+                html.P(id='selection-stats')  # Summary of the selected points
+            ], style={'width': '30%', 'display': 'inline-block', 'verticalAlign': 'top'})
+        ], style={'display': 'block'}),
+        html.Div([
+            html.Div(
+                dcc.Graph(id='mpg-scatter', figure=mpg_figure()), style={'width': '50%', 'display': 'inline-block'}
+            ),
+            html.Div(
+                dcc.Graph(id='mpg-line', figure=mpg_line_figure()),
+                style={'width': '20%', 'height': '50%', 'display': 'inline-block'}),
+            html.Div([dcc.Markdown(id='mpg-stats')], style={'width': '20%', 'height': '50%', 'display': 'inline-block'})
+        ])
+    ], style={'backgroundColor': colors['background']})  # Style of the initial container you crated at the beginning
+
+
+app.layout = serve_layout if FAST_START else serve_layout()
 
 
 # ---------------------------------------------------- Callbaks ----------------------------------------------------
-@app.callback(Output('live-text-update', 'children'), [Input('interval-component', 'n_intervals')])
+# True if the callback was triggered by a zoom/pan (relayoutData) of the graph graph_id
+def zoom_triggered(graph_id):
+    return any(t['prop_id'] == graph_id + '.relayoutData' for t in dash.callback_context.triggered)
+
+
+# Row of the hovered point: a downsampled trace (see traces.py) stores the row number in customdata
+def row_index(hover_data):
+    point = hover_data['points'][0]
+    return point.get('customdata', point['pointIndex'])
+
+
+# Columns of the hovered mpg row
+def mpg_row(index):
+    return {column: values[index] for column, values in mpg_records.items()}
+
+
+# Opt-in: the figure callbacks return a dash.Patch with only what changed (trace arrays, axis title) instead of a whole
+# new figure, when one Input changed. The first call of a page (no Input changed) still returns the whole figure.
+PARTIAL_UPDATES = False
+
+
+def partial_update():
+    return PARTIAL_UPDATES and len(dash.callback_context.triggered_prop_ids) == 1
+
+
+def figure_patch(figure, trace_keys=None, layout_keys=()):
+    """dash.Patch setting the traces of figure (only their trace_keys if given), and its layout_keys."""
+    patch = dash.Patch()
+    if trace_keys is None:
+        patch['data'] = figure['data']  # One operation: cheaper than one per key when all the arrays change
+    else:
+        for i, trace in enumerate(figure['data']):
+            for key in trace_keys:
+                if key in trace:
+                    patch['data'][i][key] = trace[key]
+    for key in layout_keys:
+        patch['layout'][key] = figure['layout'][key]
+    return patch
+
+
+# The callbacks that only format a string run in the browser (no HTTP round-trip, no server work): the decorated
+# Python function is not registered, the JavaScript one is. Set CLIENTSIDE_CALLBACKS = False to run them on the server.
+CLIENTSIDE_CALLBACKS = True
+
+
+def formatting_callback(javascript, *args):
+    def register(function):
+        if CLIENTSIDE_CALLBACKS:
+            app.clientside_callback(javascript, *args)
+            return function  # Still callable from Python (e.g. in tests)
+        return metrics.callback(*args)(function)
+    return register
+
+
+@formatting_callback('function(n) { return `Crash free for ${n} refreshes.`; }',
+                     Output('live-text-update', 'children'), [Input('interval-component', 'n_intervals')])
 def update_layout(n):
     return f'Crash free for {n} refreshes.'
 
 
+# Streaming: append only the rows written since the previous tick of this session, keeping at most LIVE_MAX_POINTS
+@metrics.callback([Output('live-graph', 'extendData'), Output('live-cursor', 'data')],
+                  [Input('interval-component', 'n_intervals')],
+                  [State('live-cursor', 'data')])
+def update_live_graph(n, cursor):
+    with metrics.phase('filter'):
+        cursor, t, values = live_source.read_after(cursor, LIVE_MAX_POINTS)
+    if not t:
+        raise PreventUpdate  # Nothing new: nothing sent
+    return ({'x': [t], 'y': [values]}, [0], LIVE_MAX_POINTS), cursor
+
+
 # Callback for filling the children of the Div with id='my-div', with the output of update_div when a Button is pressed
-@app.callback(Output(component_id='my-div', component_property='children'),
-              # The input is the Submit button (when you have a State in the callback). Otherwise is simply the Input.
-              [Input(component_id='submit-button', component_property='n_clicks')],
-              # If you have a State, you give him the Input text you want displayed once Submit is pressed.
-              [State(component_id='text-input', component_property='value')])
+@formatting_callback('function(n_clicks, input_value) { '
+                     'return `You entered: ${input_value} and clicked ${n_clicks} times.`; }',
+                     Output(component_id='my-div', component_property='children'),
+                     # The input is the Submit button (when you have a State in the callback). Otherwise is the Input.
+                     [Input(component_id='submit-button', component_property='n_clicks')],
+                     # If you have a State, you give him the Input text you want displayed once Submit is pressed.
+                     [State(component_id='text-input', component_property='value')])
 def update_div(n_clicks, input_value):  # n_clicks is first because Input came before State
     return f'You entered: {input_value} and clicked {n_clicks} times.'  # It is not mandatory to use n_clicks.
 
 
 # Callback to update the graph based on the year selected in the Dropdown menu
-@app.callback(Output('graph', 'figure'),  # The Output is the Figure field of the graph.
-              [Input('year-picker', 'value')])  # Input is the numeric value of the year you selected in the Dropdown
-def update_figure(selected_year):
-    filtered_df = df[df['year'] == selected_year]
-    traces = []
-    for continent_name in df['continent'].unique():
-        df_by_continent = filtered_df[filtered_df['continent'] == continent_name]
-        traces.append(go.Scatter(
-            x=df_by_continent['gdpPercap'],
-            y=df_by_continent['lifeExp'],
-            mode='markers',
-            marker={'size': 15, 'opacity': 0.7},
-            name=continent_name
-        ))
-    return {'data': traces, 'layout': go.Layout(title='My Plot',
-                                                xaxis={'title': 'GDP per Capita', 'type': 'log'},
-                                                yaxis={'title': 'Life Expectancy'})}
+@metrics.callback(Output('graph', 'figure'),  # The Output is the Figure field of the graph.
+                  [Input('year-picker', 'value'),  # Input is the numeric value of the year you selected in the Dropdown
+                   Input('graph', 'relayoutData')])  # Zoom: big traces are downsampled again in the zoomed window
+def update_figure(selected_year, relayout_data):
+    if zoom_triggered('graph') and not needs_downsampling(gapminder_max_points.get(selected_year, 0)):
+        raise PreventUpdate  # All the points are already in the browser: plotly zooms by itself
+    figure = gapminder_figure(selected_year, axis_window(relayout_data))
+    if not partial_update():
+        return figure
+    return figure_patch(figure)  # All the arrays change with the year, the layout does not
+
+
+# The figure only depends on the year (and zoom window), so the last few figures are kept in memory (LRU cache), and
+# in the cache shared by the worker processes.
+@functools.lru_cache(maxsize=FIGURE_CACHE_SIZE)
+@shared_memoize  # Built once for all the workers
+def gapminder_figure(selected_year, window=None):
+    with metrics.phase('filter'):
+        arrays = [gapminder_index.get((selected_year, continent_name), (empty, empty))  # No rows: an empty trace
+                  for continent_name in continents]
+    with metrics.phase('figure'):
+        traces = []
+        for continent_name, (x, y) in zip(continents, arrays):
+            traces.append(scatter_trace(
+                x=x,
+                y=y,
+                mode='markers',
+                window=window,
+                log_x=True,
+                marker={'size': 15, 'opacity': 0.7},
+                name=continent_name
+            ))
+        return {'data': traces, 'layout': {'title': {'text': 'My Plot'},
+                                           'xaxis': {'title': {'text': 'GDP per Capita'}, 'type': 'log'},
+                                           'yaxis': {'title': {'text': 'Life Expectancy'}},
+                                           'uirevision': 'gapminder'}}  # Keep the zoom when the year changes
 
 
 # Callback to update the graph using 2 Inputs
-@app.callback(Output('feature-graphic', 'figure'), [Input('xaxis', 'value'), Input('yaxis', 'value')])
-def update_graph(xaxis_name, yaxis_name):
-    traces = [go.Scatter(
-        x=df2[xaxis_name],
-        y=df2[yaxis_name],
-        text=df2['name'],
-        mode='markers',
-        marker={'size': 15, 'opacity': 0.5, 'line': {'width': 0.5, 'color': 'white'}},
-        name=xaxis_name + ' vs ' + yaxis_name
-    )]
-    return {'data': traces, 'layout': go.Layout(title='My Plot2',
-                                                xaxis={'title': xaxis_name},
-                                                yaxis={'title': yaxis_name},
-                                                hovermode='closest')}
+@metrics.callback(Output('feature-graphic', 'figure'),
+                  [Input('xaxis', 'value'), Input('yaxis', 'value'), Input('feature-graphic', 'relayoutData')])
+def update_graph(xaxis_name, yaxis_name, relayout_data):
+    if zoom_triggered('feature-graphic'):
+        if not needs_downsampling(len(df2)):
+            raise PreventUpdate
+        window = axis_window(relayout_data)
+    else:
+        window = None  # New axes: the previous zoom does not apply
+    figure = feature_figure(xaxis_name, yaxis_name, window)
+    if not partial_update():
+        return figure
+    changed = dash.callback_context.triggered_id
+    if needs_downsampling(len(df2)):  # The points kept depend on both axes and on the zoom
+        trace_keys = ['x', 'y', 'text', 'customdata']
+    else:  # Only the axis that changed
+        trace_keys = ['x' if changed == 'xaxis' else 'y']
+    layout_keys = [] if changed == 'feature-graphic' else [changed, 'uirevision']  # Title of the axis, zoom reset
+    return figure_patch(figure, trace_keys + ['name'], layout_keys)
+
+
+@shared_memoize
+def feature_figure(xaxis_name, yaxis_name, window):
+    with metrics.phase('filter'):
+        x, y, text = df2[xaxis_name], df2[yaxis_name], df2['name']
+    with metrics.phase('figure'):
+        traces = [scatter_trace(
+            x=x,
+            y=y,
+            text=text,
+            mode='markers',
+            window=window,
+            marker={'size': 15, 'opacity': 0.5, 'line': {'width': 0.5, 'color': 'white'}},
+            name=xaxis_name + ' vs ' + yaxis_name
+        )]
+        return {'data': traces, 'layout': {'title': {'text': 'My Plot2'},
+                                           'xaxis': {'title': {'text': xaxis_name}},
+                                           'yaxis': {'title': {'text': yaxis_name}},
+                                           'hovermode': 'closest',
+                                           'uirevision': xaxis_name + ' vs ' + yaxis_name}}
 
 
 # Callback to update the multi-input and multi-output plots
-@app.callback(Output('wheels-output', 'children'), [Input('wheels', 'value')])
+@formatting_callback('function(wheel_value) { return `You chose ${wheel_value}`; }',
+                     Output('wheels-output', 'children'), [Input('wheels', 'value')])
 def callback_a(wheel_value):
     return f'You chose {wheel_value}'
 
 
-@app.callback(Output('colors-output', 'children'), [Input('colors', 'value')])
+@formatting_callback('function(color_value) { return `You chose ${color_value}`; }',
+                     Output('colors-output', 'children'), [Input('colors', 'value')])
 def callback_b(color_value):
     return f'You chose {color_value}'
 
 
-@app.callback(Output('display-img', 'src'), [Input('wheels', 'value'), Input('colors', 'value')])
+@metrics.callback(Output('display-img', 'src'), [Input('wheels', 'value'), Input('colors', 'value')])
 def callback_img(wheel, color):
-    path = 'data/Images/'
-    return encode_image(path + df3[(df3['wheels'] == wheel) & (df3['color'] == color)]['image'].values[0])
+    return image_src(wheel_images[(wheel, color)])
 
 
 # Here if the mouse is on a data point of the plot, you will display a different image.
-@app.callback(Output('hover-data', 'src'),  # Output is the Pre for text display
-              [Input('wheel-plot', 'clickData')])  # Input is clickData: info when the mouse clicks on a data point
+@metrics.callback(Output('hover-data', 'src'),  # Output is the Pre for text display
+                  [Input('wheel-plot', 'clickData')])  # Input is clickData: info when the mouse clicks on a data point
 #              [Input('wheel-plot', 'hoverData')])  # Input is the hoverData: info when the mouse is on a data point
 def callback_image(hoverData):
     if hoverData is not None:
         wheel = hoverData['points'][0]['y']  # HoverData isthe info about the data point you are selecting
         color = hoverData['points'][0]['x']
-        path = 'data/Images/'
-        return encode_image(path + df3[(df3['wheels'] == wheel) & (df3['color'] == color)]['image'].values[0])
+        return image_src(wheel_images[(wheel, color)])
 
 
-@app.callback(Output('density', 'children'),  # In the H1 with id=density you are populating the text
-              [Input('plot', 'selectedData')])  # The function input are the selected data with Lasso or Box selection
+# The selection engine counts the points of dfx inside the Box/Lasso (exact polygon test and area), instead of using
+# the points sent back by the browser and the bounding box of the selection.
+@metrics.callback([Output('density', 'children'),  # In the H1 with id=density you are populating the text
+                   Output('selection-stats', 'children')],
+                  [Input('plot', 'selectedData')])  # The function input are the data selected with Lasso or Box
 def find_sensity(selectedData):
-    if selectedData is not None:
-        pts = len(selectedData['points'])
-        rng_or_lp = list(selectedData.keys())
-        rng_or_lp.remove('points')
-        max_x = max(selectedData[rng_or_lp[0]]['x'])
-        min_x = min(selectedData[rng_or_lp[0]]['x'])
-        max_y = max(selectedData[rng_or_lp[0]]['y'])
-        min_y = min(selectedData[rng_or_lp[0]]['y'])
-        area = (max_x - min_x) * (max_y - min_y)
-        d = pts / area
-        return f'Density is {d:.2f}'
-
-
-@app.callback(Output('mpg-line', 'figure'),
-              [Input('mpg-scatter', 'hoverData')])
-def callback_graph(hover_data):
-    v_index = hover_data['points'][0]['pointIndex']
-    figure = {'data': [go.Scatter(x=[0, 1],
-                                  y=[0, 60 / df2.iloc[v_index]['acceleration']],  # Miles per minutes
-                                  mode='lines',
-                                  line={'width': 2 * df2.iloc[v_index]['cylinders']})],
-              'layout': go.Layout(title=df2.iloc[v_index]['name'],
-                                  xaxis={'visible': False},
-                                  yaxis={'visible': False,
-                                         'range': [0, 60 / df2['acceleration'].min()]},
-                                  margin={'l': 0},
-                                  height=300)}
+    if selectedData is None:
+        return None, None
+    with metrics.phase('filter'):
+        summary = selection_engine.summarize(selectedData)
+    if summary is None:  # A click selection: no Box/Lasso
+        return None, None
+    if summary['density'] is None:
+        density = 'Density is undefined (empty area)'
+    else:
+        density = f"Density is {summary['density']:.2f}"
+    stats = f"{summary['count']} points, area {summary['area']:.2f}"
+    if summary['count']:
+        stats += (f", mean x {summary['mean_x']:.2f} (from {summary['min_x']:.2f} to {summary['max_x']:.2f})"
+                  f", mean y {summary['mean_y']:.2f} (from {summary['min_y']:.2f} to {summary['max_y']:.2f})")
+    return density, stats
+
+
+# Both mpg-line and mpg-stats change at every hover of mpg-scatter (the most frequent event): a single callback
+# serves both outputs from one lookup in the precomputed arrays.
+@metrics.callback([Output('mpg-line', 'figure'), Output('mpg-stats', 'children')],
+                  [Input('mpg-scatter', 'hoverData')])
+def callback_hover(hover_data):
+    if hover_data is None:  # Initial call: nothing hovered yet
+        raise PreventUpdate
+    with metrics.phase('filter'):
+        row = mpg_row(row_index(hover_data))
+    with metrics.phase('figure'):
+        return callback_graph(row), callback_stats(row)
+
+
+def callback_graph(row):
+    figure = {'data': [plain_trace('scatter',
+                                   x=[0, 1],
+                                   y=[0, 60 / row['acceleration']],  # Miles per minutes
+                                   mode='lines',
+                                   line={'width': 2 * row['cylinders']})],
+              'layout': {'title': {'text': row['name']},
+                         'xaxis': {'visible': False},
+                         'yaxis': {'visible': False,
+                                   'range': [0, max_speed]},
+                         'margin': {'l': 0},
+                         'height': 300}}
     return figure
 
 
 # Same
-@app.callback(Output('mpg-stats', 'children'),
-              [Input('mpg-scatter', 'hoverData')])
-def callback_stats(hover_data):
-    v_index = hover_data['points'][0]['pointIndex']
+def callback_stats(row):
     stats = '''
     {} cylinders
     {} cc displacement
     From 0 to 60 mph in {} seconds
-    '''.format(df2.iloc[v_index]['cylinders'], df2.iloc[v_index]['displacement'], df2.iloc[v_index]['acceleration'])
+    '''.format(row['cylinders'], row['displacement'], row['acceleration'])
     return stats
 
 
@@ -0,0 +1,56 @@
+# Server-side aggregation of long-format data (one row per x, y, z) into the dense 2D grid of a heatmap.
+# The browser then gets one value per cell instead of every row: the size of the figure depends on the grid
+# resolution, not on the number of rows.
+import numpy as np
+import pandas as pd
+
+REDUCERS = ('sum', 'mean', 'count', 'min', 'max')
+
+
+def _codes(values, bin_size):
+    """Return (cell index of every value, label of every cell).
+
+    bin_size None: one cell per distinct value (sorted if numeric, in order of appearance otherwise, e.g. months).
+    Otherwise: numeric cells of width bin_size, labelled by their start.
+    """
+    values = np.asarray(values)
+    if bin_size is None:
+        if values.dtype.kind in 'iuf':
+            labels, codes = np.unique(values, return_inverse=True)
+        else:
+            codes, labels = pd.factorize(values, sort=False)
+        return codes.ravel(), np.asarray(labels)
+    start = np.nanmin(values)
+    codes = np.floor((values - start) / bin_size).astype(np.int64)
+    return codes, start + bin_size * np.arange(codes.max() + 1)
+
+
+def grid_aggregate(df, x, y, z, x_bin=None, y_bin=None, reducer='sum'):
+    """Aggregate the column z of df on the grid of the columns x and y.
+
+    Returns (x labels, y labels, 2D array of shape (len(y labels), len(x labels))), ready for go.Heatmap. Empty cells
+    are NaN (0 for 'count'). The rows with a missing x, y or z are dropped: they belong to no cell.
+    """
+    if reducer not in REDUCERS:
+        raise ValueError(f'Unknown reducer {reducer!r}, use one of {REDUCERS}')
+    present = df[[x, y, z]].notna().all(axis=1).to_numpy()
+    if not present.all():  # factorize would give them the code -1, and a NaN cast to int64 a random cell
+        df = df[present]
+    x_codes, x_labels = _codes(df[x], x_bin)
+    y_codes, y_labels = _codes(df[y], y_bin)
+    n_cells = len(x_labels) * len(y_labels)
+    cells = y_codes * len(x_labels) + x_codes  # Flat index of the cell of every row
+    values = np.asarray(df[z], dtype=float)
+    counts = np.bincount(cells, minlength=n_cells)
+    if reducer == 'count':
+        grid = counts.astype(float)
+    elif reducer in ('sum', 'mean'):
+        grid = np.bincount(cells, weights=values, minlength=n_cells)
+        if reducer == 'mean':
+            with np.errstate(invalid='ignore', divide='ignore'):
+                grid = grid / counts
+        grid[counts == 0] = np.nan
+    else:
+        grid = np.full(n_cells, np.nan)
+        (np.fmin if reducer == 'min' else np.fmax).at(grid, cells, values)
+    return x_labels, y_labels, grid.reshape(len(y_labels), len(x_labels))
@@ -0,0 +1,333 @@
+# Benchmark of the dashboard callbacks (1_dash_00.py) and of the figure builders (0_plotly.py).
+# Every server-side callback is called through the Flask test client, exactly like the browser does, and every
+# figure builder is called directly. This is done on the bundled CSV files and on synthetic copies of them scaled
+# N times (rows repeated with a small jitter on the float columns). For each one we report the latency percentiles
+# of cold calls (figure caches cleared before each call, the ones checked against the baseline), the p50 of warm
+# calls (served from those caches), the peak memory (tracemalloc) and the size of the serialized payload (for the
+# callbacks, also the bytes sent to a browser accepting brotli/gzip). Usage:
+#   python benchmark.py                            # Print the report (scales 1, 10, 100)
+#   python benchmark.py --scales 1 10 100 1000     # Also the 1000x datasets
+#   python benchmark.py --save-baseline            # Save the results in benchmark_baseline.json
+#   python benchmark.py --check                    # Fail (exit code 1) if something is slower/bigger than the baseline
+#   python benchmark.py --startup                  # Cold start of the dashboard: import time and first requests
+import argparse
+import base64
+import importlib.util
+import json
+import logging
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+import warnings
+
+import numpy as np
+import pandas as pd
+import plotly.io as pio
+
+import credentials
+import data_loader
+import distplot
+import traces
+from live_stream import SQLiteSource
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+BENCH_USER = ('benchmark', 'benchmark')  # The only user of the credentials file of the benchmark
+LIVE_POINTS = 5000  # Rows of the live database of the benchmark (random walk with a fixed seed)
+BASELINE_FILE = os.path.join(ROOT, 'benchmark_baseline.json')
+# A sample value for every callback Input/State, keyed by 'component-id.property'. Missing ones are None.
+INPUT_VALUES = {
+    'interval-component.n_intervals': 5,
+    'submit-button.n_clicks': 3,
+    'text-input.value': 'benchmark',
+    'year-picker.value': 2007,
+    'xaxis.value': 'displacement',
+    'yaxis.value': 'mpg',
+    'wheels.value': 1,
+    'colors.value': 'red',
+    'wheel-plot.clickData': {'points': [{'x': 'red', 'y': 1}]},
+    'plot.selectedData': {'points': [{'pointIndex': i, 'x': 1 + i * 0.06, 'y': i % 50} for i in range(50)],
+                          'range': {'x': [1, 4], 'y': [0, 40]}},
+    'mpg-scatter.hoverData': {'points': [{'pointIndex': 10, 'x': 1970, 'y': 15}]},
+}
+# Run in a new interpreter (python -X importtime): a cold start of the dashboard, as in a new worker. Prints the
+# timings as JSON on stdout (the import times go to stderr).
+STARTUP_SCRIPT = """
+import base64, importlib.util, json, logging, sys, time, warnings
+warnings.simplefilter('ignore')
+start = time.perf_counter()
+spec = importlib.util.spec_from_file_location('dash_app', '1_dash_00.py')
+dash_app = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(dash_app)
+timings = {'load module': time.perf_counter() - start}
+logging.getLogger().setLevel(logging.ERROR)
+from benchmark import BENCH_USER, request_body
+client = dash_app.app.server.test_client()
+headers = {'Authorization': 'Basic ' + base64.b64encode(':'.join(BENCH_USER).encode()).decode()}
+for url in ('/', '/_dash-layout', '/_dash-dependencies'):
+    start = time.perf_counter()
+    client.get(url, headers=headers)
+    timings['first GET ' + url] = time.perf_counter() - start
+spec = dash_app.app.callback_map['graph.figure']
+start = time.perf_counter()
+client.post('/_dash-update-component', json=request_body('graph.figure', spec), headers=headers)
+timings['first callback update_figure'] = time.perf_counter() - start
+print(json.dumps(timings))
+"""
+
+
+def bench_credentials():
+    """Make the dashboard use a temporary credentials file with BENCH_USER only (DASH_CREDENTIALS)."""
+    path = os.path.join(tempfile.mkdtemp(), 'credentials.txt')
+    with open(path, 'w') as f:
+        f.write(f'{BENCH_USER[0]}:{credentials.hash_password(BENCH_USER[1])}\n')
+    os.environ['DASH_CREDENTIALS'] = path
+
+
+def bench_live_db():
+    """Make the dashboard tail a temporary live database with the same LIVE_POINTS rows at every run (DASH_LIVE_DB)."""
+    path = os.path.join(tempfile.mkdtemp(), 'live.sqlite')
+    values = np.cumsum(np.random.default_rng(0).standard_normal(LIVE_POINTS))
+    SQLiteSource(path).append(values.tolist(), t=(1.5e9 + np.arange(LIVE_POINTS)).tolist())
+    os.environ['DASH_LIVE_DB'] = path
+
+
+def load_script(filename, module_name):
+    """Import one of the scripts of the repo (their names start with a digit, so 'import' cannot be used)."""
+    spec = importlib.util.spec_from_file_location(module_name, os.path.join(ROOT, filename))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def scale_data(scale):
+    """Make data_loader.load_csv return every CSV repeated 'scale' times (float columns get a 1% jitter)."""
+    original = data_loader.__dict__.setdefault('_original_load_csv', data_loader.load_csv)
+    if scale == 1:
+        data_loader.load_csv = original
+        return
+    rng = np.random.default_rng(0)
+    scaled = {}
+
+    def load_scaled_csv(filename):
+        if filename not in scaled:
+            frame = pd.concat([original(filename)] * scale, ignore_index=True)
+            for column in frame.columns[frame.dtypes == 'float64']:
+                frame[column] = frame[column] * rng.uniform(0.99, 1.01, len(frame))
+            scaled[filename] = frame
+        return scaled[filename].copy(deep=False)
+    data_loader.load_csv = load_scaled_csv
+
+
+def measure(function, repeat, reset=None):
+    """Return (sorted cold latencies in ms, sorted warm latencies in ms, peak memory in MB, result of the last call).
+
+    reset clears the result caches of the measured code: each cold call runs right after it (the figure is really
+    built), and is followed by a warm call (served from those caches).
+    """
+    reset = reset or (lambda: None)
+    function()  # Warm-up: imports, first-call caches
+    cold, warm = [], []
+    for _ in range(repeat):
+        reset()
+        start = time.perf_counter()
+        function()
+        cold.append((time.perf_counter() - start) * 1000)
+        start = time.perf_counter()
+        result = function()
+        warm.append((time.perf_counter() - start) * 1000)
+    reset()
+    tracemalloc.start()  # Separate call: tracemalloc slows down the allocations
+    function()
+    peak = tracemalloc.get_traced_memory()[1] / 1e6
+    tracemalloc.stop()
+    return sorted(cold), sorted(warm), peak, result
+
+
+def summary(cold, warm, peak, payload):
+    """The latency percentiles are the ones of the cold calls (the --check gate), plus the p50 of the warm ones."""
+    def percentile(latencies, q):
+        return round(float(np.percentile(latencies, q)), 3)
+    return {'p50_ms': percentile(cold, 50), 'p95_ms': percentile(cold, 95), 'p99_ms': percentile(cold, 99),
+            'max_ms': round(cold[-1], 3), 'warm_p50_ms': percentile(warm, 50), 'peak_mb': round(peak, 3),
+            'payload_bytes': payload}
+
+
+def request_body(output, spec):
+    """Body of the POST /_dash-update-component sent by the browser to run the callback of 'output'."""
+    def component(key):
+        component_id, prop = key.rsplit('.', 1)
+        return {'id': component_id, 'property': prop}
+    if output.startswith('..'):  # Multi-output callback: '..a.children...b.figure..'
+        outputs = [component(key) for key in output.strip('.').split('...')]
+    else:
+        outputs = component(output)
+
+    def with_values(items):
+        return [dict(item, value=INPUT_VALUES.get(f"{item['id']}.{item['property']}")) for item in items]
+    inputs = with_values(spec['inputs'])
+    return {'output': output, 'outputs': outputs, 'inputs': inputs, 'state': with_values(spec['state']),
+            'changedPropIds': [f"{inputs[0]['id']}.{inputs[0]['property']}"]}
+
+
+def bench_callbacks(scale, repeat):
+    dash_app = load_script('1_dash_00.py', f'dash_app_x{scale}')
+    if dash_app.Cache is not None:
+        dash_app.cache.clear()  # The file cache is shared by all the scales
+    client = dash_app.app.server.test_client()  # Keeps the session cookie: the password is only checked once
+    headers = {'Authorization': 'Basic ' + base64.b64encode(':'.join(BENCH_USER).encode()).decode()}
+
+    def reset():  # The figure caches of the callbacks (in memory and shared by the workers)
+        dash_app.gapminder_figure.cache_clear()
+        if dash_app.Cache is not None:
+            dash_app.cache.clear()
+    results = {}
+    for output, spec in dash_app.app.callback_map.items():
+        if 'callback' not in spec:  # Clientside callback: runs in the browser
+            continue
+        body = request_body(output, spec)
+        name = spec['callback'].__name__
+
+        def call():
+            return client.post('/_dash-update-component', json=body, headers=headers)
+        cold, warm, peak, response = measure(call, repeat, reset)
+        if response.status_code not in (200, 204):  # 204: PreventUpdate
+            results[name] = {'error': f'HTTP {response.status_code}'}
+            continue
+        error = invalid_figure(response)
+        if error:
+            results[name] = {'error': error}
+            continue
+        results[name] = summary(cold, warm, peak, len(response.data))
+        compressed = client.post('/_dash-update-component', json=body,
+                                 headers={**headers, 'Accept-Encoding': 'br, gzip'})
+        results[name]['wire_bytes'] = len(compressed.data)  # Without flask-compress: same as payload_bytes
+    return results
+
+
+def invalid_figure(response):
+    """The callbacks build plain-dict figures without validation: check the returned ones against the plotly schema."""
+    if response.status_code != 200:
+        return None
+    for component_id, props in response.get_json()['response'].items():
+        if 'figure' in props:
+            try:
+                traces.validate_figure(props['figure'])
+            except ValueError as error:
+                return f'invalid {component_id}.figure: ' + str(error).splitlines()[0]
+    return None
+
+
+def bench_builders(scale, repeat):
+    gallery = load_script('0_plotly.py', f'gallery_x{scale}')
+    results = {}
+    for name, (builder, _) in gallery.FIGURES.items():
+        cold, warm, peak, figures = measure(builder, repeat, distplot._kde_cache.clear)  # The KDE curves of dist
+        payload = sum(len(pio.to_json(fig, validate=False)) for fig in
+                      (fig if not isinstance(fig, list) else {'data': fig} for fig in figures.values()))
+        results[name] = summary(cold, warm, peak, payload)
+    return results
+
+
+def run(scales, repeat):
+    report = {}
+    for scale in scales:
+        scale_data(scale)
+        report[f'x{scale}'] = {'callbacks': bench_callbacks(scale, repeat),
+                               'builders': bench_builders(scale, max(1, repeat // 5))}
+    scale_data(1)
+    return report
+
+
+def startup(top=10):
+    """Cold start of 1_dash_00.py in a new interpreter: print the load and first-request times, and the 'top'
+    slowest top-level imports."""
+    process = subprocess.run([sys.executable, '-X', 'importtime', '-c', STARTUP_SCRIPT], cwd=ROOT,
+                             capture_output=True, text=True, check=True)
+    timings = json.loads(process.stdout.splitlines()[-1])
+    for step, seconds in timings.items():
+        print(f'{step:32} {seconds * 1000:9.1f} ms')
+    imports = []  # Lines 'import time: self [us] | cumulative | package', nested imports are indented
+    for line in process.stderr.splitlines():
+        if line.startswith('import time:') and not line.endswith('package'):
+            _, cumulative, name = line.split('|')
+            if not name.startswith('  '):
+                imports.append((int(cumulative), name.strip()))
+    print('Slowest imports:')
+    for cumulative, name in sorted(imports, reverse=True)[:top]:
+        print(f'  {name:30} {cumulative / 1000:9.1f} ms')
+
+
+def print_report(report):
+    print(f"{'dataset':8} {'kind':9} {'name':16} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'warm p50':>9} "
+          f"{'peak MB':>8} {'payload':>10} {'wire':>8}")
+    for dataset, kinds in report.items():
+        for kind, results in kinds.items():
+            for name, r in results.items():
+                if 'error' in r:
+                    print(f"{dataset:8} {kind:9} {name:16} {r['error']}")
+                    continue
+                print(f"{dataset:8} {kind:9} {name:16} {r['p50_ms']:9.2f} {r['p95_ms']:9.2f} {r['p99_ms']:9.2f} "
+                      f"{r['warm_p50_ms']:9.2f} {r['peak_mb']:8.2f} {r['payload_bytes']:10d} "
+                      f"{r.get('wire_bytes', '-'):>8}")
+
+
+def check(report, baseline, tolerance, slack_ms):
+    """Return the list of regressions of report with respect to baseline."""
+    regressions = []
+    for dataset, kinds in report.items():
+        for kind, results in kinds.items():
+            for name, r in results.items():
+                old = baseline.get(dataset, {}).get(kind, {}).get(name)
+                if old is None:
+                    continue
+                where = f'{dataset} {kind} {name}'
+                if 'error' in r and 'error' not in old:
+                    regressions.append(f"{where}: {r['error']}")
+                    continue
+                if 'error' in r or 'error' in old:
+                    continue
+                if r['p50_ms'] > old['p50_ms'] * (1 + tolerance) + slack_ms:
+                    regressions.append(f"{where}: p50 {old['p50_ms']:.2f} -> {r['p50_ms']:.2f} ms")
+                if r['payload_bytes'] > old['payload_bytes'] * (1 + tolerance):
+                    regressions.append(f"{where}: payload {old['payload_bytes']} -> {r['payload_bytes']} bytes")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the dashboard callbacks and the figure builders.')
+    parser.add_argument('--scales', type=int, nargs='+', default=[1, 10, 100], help='Dataset scale factors')
+    parser.add_argument('--repeat', type=int, default=20, help='Calls per callback (builders: repeat / 5)')
+    parser.add_argument('--save-baseline', action='store_true', help=f'Save the results in {BASELINE_FILE}')
+    parser.add_argument('--check', action='store_true', help='Compare with the baseline, exit code 1 if slower')
+    parser.add_argument('--tolerance', type=float, default=0.5, help='Allowed relative increase (0.5 = +50%%)')
+    parser.add_argument('--slack-ms', type=float, default=2.0, help='Allowed absolute increase of the p50 latency')
+    parser.add_argument('--startup', action='store_true', help='Only report the cold start of the dashboard')
+    args = parser.parse_args()
+
+    bench_credentials()
+    bench_live_db()
+    if args.startup:
+        startup()
+        return
+    os.chdir(ROOT)  # The scripts use paths relative to the repo
+    warnings.simplefilter('ignore')
+    logging.getLogger().setLevel(logging.ERROR)  # Only the report on stdout
+    report = run(args.scales, args.repeat)
+    print_report(report)
+    if args.save_baseline:
+        with open(BASELINE_FILE, 'w') as f:
+            json.dump(report, f, indent=1, sort_keys=True)
+    if args.check:
+        with open(BASELINE_FILE) as f:
+            regressions = check(report, json.load(f), args.tolerance, args.slack_ms)
+        for regression in regressions:
+            print('REGRESSION ' + regression)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,148 @@
+# Hashed passwords for the HTTP Basic authentication of the dashboard.
+# The credentials file has one 'username:scrypt:n:r:p:salt:hash' line per user (salt and hash in base64). scrypt is
+# slow on purpose, so it runs once per login: SessionBasicAuth then puts a token in the signed Flask session cookie,
+# and the next requests (Interval ticks, hovers, ...) only check that token (a dict lookup and a comparison).
+# The file is reloaded when it changes, without restarting the server: the tokens of a user whose entry changed (new
+# password, or user removed) are no longer valid. Add or replace a user with:
+#   python credentials.py USERNAME [--file credentials.txt]
+import argparse
+import base64
+import functools
+import getpass
+import hashlib
+import hmac
+import logging
+import os
+import threading
+import time
+
+import dash_auth
+import flask
+
+SCRYPT_PARAMS = {'n': 2 ** 14, 'r': 8, 'p': 1}  # ~50 ms and 16 MB per verification
+SESSION_LIFETIME = 12 * 3600  # Seconds before the password is asked again
+RELOAD_INTERVAL = 1.0  # The file mtime is checked at most once per second
+
+
+def hash_password(password, n=SCRYPT_PARAMS['n'], r=SCRYPT_PARAMS['r'], p=SCRYPT_PARAMS['p']):
+    """Return the 'scrypt:n:r:p:salt:hash' string stored in the credentials file."""
+    salt = os.urandom(16)
+    key = hashlib.scrypt(password.encode(), salt=salt, n=n, r=r, p=p)
+    return f'scrypt:{n}:{r}:{p}:{base64.b64encode(salt).decode()}:{base64.b64encode(key).decode()}'
+
+
+def verify_password(password, encoded):
+    scheme, n, r, p, salt, key = encoded.split(':')
+    if scheme != 'scrypt':
+        raise ValueError(f'Unknown password hash {scheme!r}')
+    key = base64.b64decode(key)
+    computed = hashlib.scrypt(password.encode(), salt=base64.b64decode(salt), n=int(n), r=int(r), p=int(p),
+                              dklen=len(key))
+    return hmac.compare_digest(computed, key)
+
+
+@functools.lru_cache(maxsize=None)
+def _dummy_hash():
+    """Hash checked for unknown users: the answer takes as long as for a known user with a wrong password."""
+    return hash_password(base64.b64encode(os.urandom(16)).decode())
+
+
+class CredentialStore:
+    def __init__(self, path):
+        self.path = path
+        self._users = {}  # username -> encoded hash
+        self._mtime_ns = None
+        self._checked = 0.0
+        self._lock = threading.Lock()
+        self.reload()
+
+    def reload(self):
+        """Read the file again if it changed since the last read."""
+        with self._lock:
+            self._checked = time.monotonic()
+            mtime_ns = os.stat(self.path).st_mtime_ns
+            if mtime_ns == self._mtime_ns:
+                return
+            users = {}
+            with open(self.path) as f:
+                for line in f:
+                    line = line.strip()
+                    if line and not line.startswith('#'):
+                        username, encoded = line.split(':', 1)
+                        users[username] = encoded
+            self._users, self._mtime_ns = users, mtime_ns  # Swapped at once: readers see the old or the new dict
+
+    def users(self):
+        if time.monotonic() - self._checked > RELOAD_INTERVAL:
+            try:
+                self.reload()
+            except (OSError, ValueError):
+                logging.exception('Cannot reload %s, keeping the previous credentials', self.path)
+        return self._users
+
+    def check(self, username, password):
+        """Slow: scrypt verification of the password of username."""
+        encoded = self.users().get(username)
+        if encoded is None:
+            verify_password(password, _dummy_hash())  # Same time as a wrong password: usernames cannot be guessed
+            return False
+        return verify_password(password, encoded)
+
+    def version(self, username):
+        """Short fingerprint of the entry of username (None if unknown): it changes with the password."""
+        encoded = self.users().get(username)
+        return None if encoded is None else hashlib.sha256(encoded.encode()).hexdigest()[:16]
+
+    def set_password(self, username, password):
+        """Add or replace the entry of username in the file (written aside, then renamed)."""
+        lines = []
+        if os.path.exists(self.path):
+            with open(self.path) as f:
+                lines = [line for line in f if line.split(':', 1)[0] != username]
+        lines.append(f'{username}:{hash_password(password)}\n')
+        tmp = f'{self.path}.{os.getpid()}.tmp'
+        with open(tmp, 'w') as f:
+            f.writelines(lines)
+        os.replace(tmp, self.path)
+
+
+class SessionBasicAuth(dash_auth.BasicAuth):
+    """dash_auth.BasicAuth with the passwords of a CredentialStore, checked once per session.
+
+    The token {'user', 'version', 'time'} is kept in the Flask session, a cookie signed with the server secret key:
+    set secret_key (or the DASH_SECRET_KEY environment variable) in production, so that all the worker processes and
+    restarts accept the same cookies. Without it a random key is generated at startup (shared by the gunicorn workers
+    only with preload_app).
+    public_paths skip the password check: their view must check the request itself (e.g. the token of /metrics).
+    dash_auth's own public routes are not used for that, as they also open the layout and the Dash scripts.
+    """
+
+    def __init__(self, app, store, secret_key=None, public_paths=(), **kwargs):
+        self.store = store
+        self.public_paths = frozenset(public_paths)
+        secret_key = secret_key or os.environ.get('DASH_SECRET_KEY') or base64.b64encode(os.urandom(30)).decode()
+        super().__init__(app, auth_func=store.check, secret_key=secret_key, **kwargs)
+
+    def is_authorized(self):
+        if flask.request.path in self.public_paths:
+            return True
+        token = flask.session.get('auth')
+        if (token and time.time() - token['time'] < SESSION_LIFETIME
+                and self.store.version(token['user']) == token['version']):
+            return True
+        if not super().is_authorized():  # Checks the Authorization header with store.check (scrypt)
+            flask.session.pop('auth', None)
+            return False
+        username = flask.session['user']['email']
+        flask.session['auth'] = {'user': username, 'version': self.store.version(username), 'time': time.time()}
+        return True
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Add or replace a user of the dashboard credentials file.')
+    parser.add_argument('username')
+    parser.add_argument('--file', default='credentials.txt', help='Credentials file (created if missing)')
+    args = parser.parse_args()
+    if not os.path.exists(args.file):
+        open(args.file, 'w').close()
+    CredentialStore(args.file).set_password(args.username, getpass.getpass(f'Password of {args.username}: '))
@@ -0,0 +1,150 @@
+# Shared data-loading layer for 0_plotly.py and 1_dash_00.py.
+# Every CSV in data/ is parsed once with a fixed set of dtypes and stored as an uncompressed Feather (Arrow IPC) file
+# in data/.cache/. The cache is keyed on the source file's mtime and SHA-1 (and on its DTYPES entry), so it is rebuilt
+# only when the CSV or the way it is parsed really changes. Later processes (e.g. every gunicorn worker) memory-map
+# the Feather file instead of parsing text again.
+# Run `python data_loader.py` at deploy time to build the whole cache in one go.
+# Files too big to be loaded at once are read with iter_chunks: a bounded number of rows (and only the needed
+# columns) at a time, so that the figures can be computed on the fly (see streaming.py).
+import hashlib
+import json
+import os
+
+import pandas as pd
+
+try:  # pyarrow is optional: without it we simply parse the CSV (once per process).
+    import pyarrow
+    import pyarrow.feather as feather
+except ImportError:
+    feather = None
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+CACHE_DIR = os.path.join(DATA_DIR, '.cache')
+STREAM_MIN_BYTES = 64 * 1024 * 1024  # iter_chunks parses the CSV files bigger than this chunk by chunk
+CHUNK_ROWS = 100000
+
+# Fixed dtypes for every bundled CSV. '*' is the dtype of all the columns that are not listed explicitly.
+DTYPES = {
+    '2010YumaAZ.csv': {'LST_DATE': 'int64', 'DAY': str, 'LST_TIME': str, 'T_HR_AVG': 'float64'},
+    '2018WinterOlympics.csv': {'Rank': 'int64', 'NOC': str, 'Gold': 'int64', 'Silver': 'int64', 'Bronze': 'int64',
+                               'Total': 'int64'},
+    'abalone.csv': {'sex': str, 'rings': 'int64', '*': 'float64'},
+    'flights.csv': {'year': 'int64', 'month': str, 'passengers': 'int64'},
+    'gapminderDataFiveYear.csv': {'country': str, 'year': 'int64', 'pop': 'float64', 'continent': str,
+                                  'lifeExp': 'float64', 'gdpPercap': 'float64'},
+    'iris.csv': {'class': str, '*': 'float64'},
+    # 'horsepower' contains '?' for the missing values, so it stays a string as in the original file.
+    'mpg.csv': {'mpg': 'float64', 'cylinders': 'int64', 'displacement': 'float64', 'horsepower': str,
+                'weight': 'int64', 'acceleration': 'float64', 'model_year': 'int64', 'origin': 'int64', 'name': str},
+    'nst-est2017-alldata.csv': {'REGION': str, 'DIVISION': str, 'NAME': str, '*': 'float64'},
+    'wheels.csv': {'wheels': 'int64', 'color': str, 'image': str},
+}
+
+_frames = {}  # In-process memo: each file is loaded only once, even if several sections use it.
+
+
+def _dtypes(filename, path):
+    """Expand the '*' entry of DTYPES into an explicit {column: dtype} dict."""
+    spec = dict(DTYPES.get(filename, {}))
+    default = spec.pop('*', None)
+    if default is not None:
+        columns = pd.read_csv(path, nrows=0).columns  # Only the header is read
+        spec = {col: spec.get(col, default) for col in columns}
+    return spec
+
+
+def _file_hash(path):
+    sha1 = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            sha1.update(block)
+    return sha1.hexdigest()
+
+
+def _cache_key(path, meta_path):
+    """Return the SHA-1 of the CSV. The hash is recomputed only if mtime or size differ from the stored metadata."""
+    stat = os.stat(path)
+    try:
+        with open(meta_path) as f:
+            meta = json.load(f)
+        if meta['mtime_ns'] == stat.st_mtime_ns and meta['size'] == stat.st_size:
+            return meta['sha1']
+    except (OSError, ValueError, KeyError):
+        pass
+    sha1 = _file_hash(path)
+    _atomic_write(meta_path, json.dumps({'mtime_ns': stat.st_mtime_ns, 'size': stat.st_size, 'sha1': sha1}).encode())
+    return sha1
+
+
+def _atomic_write(path, payload):
+    # Several workers may build the cache at the same time: write aside and rename, so nobody reads a partial file.
+    tmp = f'{path}.{os.getpid()}.tmp'
+    with open(tmp, 'wb') as f:
+        f.write(payload)
+    os.replace(tmp, path)
+
+
+def _read_cached(filename, path):
+    stem = os.path.splitext(filename)[0]
+    dtypes = _dtypes(filename, path)
+    # The cached frame also depends on how the CSV is parsed: the dtypes and the pandas/pyarrow versions
+    sha1 = hashlib.sha1(source_hash(filename).encode())
+    sha1.update(repr(sorted(dtypes.items())).encode())
+    sha1.update(f'{pd.__version__} {pyarrow.__version__}'.encode())
+    cache_path = os.path.join(CACHE_DIR, f'{stem}.{sha1.hexdigest()[:16]}.feather')
+    if not os.path.exists(cache_path):
+        frame = pd.read_csv(path, dtype=dtypes)
+        tmp = f'{cache_path}.{os.getpid()}.tmp'
+        feather.write_feather(frame, tmp, compression='uncompressed')  # Uncompressed, so that it can be mmap-ed
+        os.replace(tmp, cache_path)
+        for old in os.listdir(CACHE_DIR):  # Drop the caches of the previous versions of this CSV
+            if old.startswith(stem + '.') and old.endswith('.feather') and old != os.path.basename(cache_path):
+                os.remove(os.path.join(CACHE_DIR, old))
+    # memory_map + split_blocks: numeric columns without nulls point straight into the mapped file (zero-copy).
+    table = feather.read_table(cache_path, memory_map=True)
+    return table.to_pandas(split_blocks=True)
+
+
+def source_hash(filename):
+    """SHA-1 of data/<filename>, rehashed only when the file mtime or size changes."""
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    stem = os.path.splitext(filename)[0]
+    return _cache_key(os.path.join(DATA_DIR, filename), os.path.join(CACHE_DIR, stem + '.json'))
+
+
+def load_csv(filename):
+    """Load data/<filename> as a DataFrame with the fixed dtypes of DTYPES.
+
+    The returned frame is a shallow copy of the memoized one: adding columns is safe, editing values in place is not.
+    """
+    if filename not in _frames:
+        path = os.path.join(DATA_DIR, filename)
+        if feather is None:
+            _frames[filename] = pd.read_csv(path, dtype=_dtypes(filename, path))
+        else:
+            _frames[filename] = _read_cached(filename, path)
+    return _frames[filename].copy(deep=False)
+
+
+def iter_chunks(filename, usecols=None, chunk_rows=CHUNK_ROWS):
+    """Yield data/<filename> as DataFrames of at most chunk_rows rows, with the fixed dtypes of DTYPES.
+
+    usecols: the columns to keep, a list or a function of the column name (as in pd.read_csv). The files bigger
+    than STREAM_MIN_BYTES are parsed one chunk at a time, so the memory used does not depend on the file size. The
+    smaller ones are sliced from load_csv (binary cache).
+    """
+    path = os.path.join(DATA_DIR, filename)
+    if os.path.getsize(path) > STREAM_MIN_BYTES:
+        yield from pd.read_csv(path, usecols=usecols, dtype=_dtypes(filename, path), chunksize=chunk_rows)
+        return
+    frame = load_csv(filename)
+    if usecols is not None:
+        frame = frame[[col for col in frame.columns if (usecols(col) if callable(usecols) else col in usecols)]]
+    for start in range(0, max(len(frame), 1), chunk_rows):  # An empty file still gives one (empty) chunk
+        yield frame.iloc[start:start + chunk_rows]
+
+
+if __name__ == '__main__':
+    # Build the cache for every bundled CSV (e.g. once per deployment, before starting the workers).
+    for name in sorted(DTYPES):
+        print(f'{name}: {load_csv(name).shape}')
@@ -0,0 +1,75 @@
+# Static figures of the dashboard layout, prebuilt as plain-dict JSON.
+# Building go.Scatter/go.Layout objects is slow (every property is validated), and the result is the same in every
+# process. The first process builds the figure and saves it in data/.cache/figures/, keyed on the builder code (and
+# the helper modules it calls), the plotly version and the input CSV files (like the stamps of 0_plotly.py). The other
+# processes (e.g. new workers) only load the JSON: plotly.graph_objs is not even used.
+import functools
+import hashlib
+import inspect
+import json
+import os
+import sys
+
+import plotly
+
+from data_loader import CACHE_DIR, source_hash
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+FIGURE_DIR = os.path.join(CACHE_DIR, 'figures')
+
+
+def helper_modules(function):
+    """The modules of this repo (other than its own) whose names function uses, e.g. traces for scatter_trace."""
+    modules = {}
+    for name in function.__code__.co_names:
+        value = function.__globals__.get(name)
+        module = value if inspect.ismodule(value) else sys.modules.get(getattr(value, '__module__', None) or '')
+        path = getattr(module, '__file__', None)
+        if path and os.path.dirname(os.path.abspath(path)) == ROOT and module.__name__ != function.__module__:
+            modules[module.__name__] = module
+    return [modules[name] for name in sorted(modules)]
+
+
+def figure_key(builder, input_csvs):
+    """Hash of the builder code, the code of the helper modules it calls, the plotly version and the input CSV files.
+
+    Module-level data of the dashboard (e.g. the random dfx) is not part of it: wsgi.py clears FIGURE_DIR at deploy.
+    """
+    sha1 = hashlib.sha1(inspect.getsource(builder).encode())
+    for module in helper_modules(builder):
+        sha1.update(inspect.getsource(module).encode())
+    sha1.update(plotly.__version__.encode())
+    for filename in input_csvs:
+        sha1.update(source_hash(filename).encode())
+    return sha1.hexdigest()[:16]
+
+
+def prebuilt_figure(*input_csvs):
+    """Decorator for a function returning a static figure (go objects or dicts) built from the CSV files input_csvs.
+
+    The decorated function returns the figure as a plain dict, loaded from the JSON cache (built if missing or out
+    of date) at the first call and kept in memory afterwards.
+    """
+    def decorate(builder):
+        @functools.wraps(builder)
+        @functools.lru_cache(maxsize=None)
+        def load():
+            os.makedirs(FIGURE_DIR, exist_ok=True)
+            path = os.path.join(FIGURE_DIR, f'{builder.__name__}.{figure_key(builder, input_csvs)}.json')
+            try:
+                with open(path) as f:
+                    return json.load(f)
+            except (OSError, ValueError):
+                pass
+            from plotly.utils import PlotlyJSONEncoder  # Only needed to build the figure
+            payload = json.dumps(builder(), cls=PlotlyJSONEncoder)  # go objects and numpy arrays -> plain JSON
+            tmp = f'{path}.{os.getpid()}.tmp'  # Several workers may build it at the same time
+            with open(tmp, 'w') as f:
+                f.write(payload)
+            os.replace(tmp, path)
+            for old in os.listdir(FIGURE_DIR):  # Drop the previous versions of this figure
+                if old.startswith(builder.__name__ + '.') and old.endswith('.json') and old != os.path.basename(path):
+                    os.remove(os.path.join(FIGURE_DIR, old))
+            return json.loads(payload)
+        return load
+    return decorate
@@ -0,0 +1,9 @@
+# gunicorn settings of the dashboard: gunicorn -c gunicorn.conf.py
+import multiprocessing
+
+wsgi_app = 'wsgi:server'
+bind = '0.0.0.0:8050'
+workers = multiprocessing.cpu_count()  # The callbacks are CPU bound (pandas/plotly): one process per core
+threads = 2  # A slow callback of a user does not block the small requests (images, Interval) of the others
+preload_app = True  # Load the data once in the master process, before forking the workers (see wsgi.py)
+timeout = 60
@@ -0,0 +1,110 @@
+# Images for the dashboard callbacks. Two ways of sending an image to the browser:
+# * ImageCache: inline base64 data URIs, kept in memory. The cache is bounded by the total size of the cached strings
+#   (least recently used entries are evicted first) and an entry is re-encoded when its file changes.
+# * StaticImages: a route on the Flask server, so that the callbacks only return a short URL. The route sends
+#   ETag/Last-Modified headers (conditional GET answers 304) and can serve thumbnails resized to the rendered height.
+import base64
+import importlib.util
+import mimetypes
+import os
+import threading
+from collections import OrderedDict
+
+import flask
+from werkzeug.security import safe_join
+
+# Pillow is optional: without it the original images are served. It is only imported when a thumbnail has to be
+# (re)built, not at the startup of every process.
+HAS_PILLOW = importlib.util.find_spec('PIL') is not None
+
+
+class ImageCache:
+    def __init__(self, max_bytes=4 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self._entries = OrderedDict()  # path -> (mtime_ns, data URI), oldest first
+        self._lock = threading.Lock()  # The dev server and the WSGI servers may call the callbacks from many threads
+
+    def get(self, path):
+        """Return the data URI of the image at path, encoding it only if it is not cached or the file changed."""
+        mtime_ns = os.stat(path).st_mtime_ns
+        with self._lock:
+            entry = self._entries.get(path)
+            if entry is not None and entry[0] == mtime_ns:
+                self._entries.move_to_end(path)
+                return entry[1]
+        uri = self._encode(path)
+        with self._lock:
+            self._store(path, mtime_ns, uri)
+        return uri
+
+    @staticmethod
+    def _encode(path):
+        with open(path, 'rb') as f:
+            encoded = base64.b64encode(f.read())  # Read and image and encode it into a binary file.
+        mime = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+        return 'data:{};base64,{}'.format(mime, encoded.decode())  # This string is how html file can add an image.
+
+    def _store(self, path, mtime_ns, uri):
+        old = self._entries.pop(path, None)
+        if old is not None:
+            self.current_bytes -= len(old[1])
+        if len(uri) > self.max_bytes:  # Bigger than the whole cache: serve it, but do not keep it
+            return
+        self._entries[path] = (mtime_ns, uri)
+        self.current_bytes += len(uri)
+        while self.current_bytes > self.max_bytes:
+            _, (_, evicted) = self._entries.popitem(last=False)
+            self.current_bytes -= len(evicted)
+
+
+class StaticImages:
+    def __init__(self, server, directory, url_prefix='/images', thumbnail_height=None, thumbnail_dir=None):
+        self.directory = os.path.abspath(directory)
+        self.url_prefix = url_prefix.rstrip('/')
+        self.thumbnail_height = thumbnail_height if HAS_PILLOW else None
+        self.thumbnail_dir = thumbnail_dir or os.path.join(self.directory, '.thumbnails')
+        server.add_url_rule(self.url_prefix + '/<path:filename>', 'static_images' + self.url_prefix.replace('/', '_'),
+                            self._serve)
+
+    def url(self, filename):
+        """URL of filename. The mtime is part of the URL, so the browser can cache it for a long time."""
+        mtime_ns = os.stat(os.path.join(self.directory, filename)).st_mtime_ns
+        return f'{self.url_prefix}/{filename}?v={mtime_ns}'
+
+    def pregenerate(self):
+        """Build the thumbnails of all the images in the directory (e.g. at startup, not at the first request)."""
+        if self.thumbnail_height is not None:
+            for filename in os.listdir(self.directory):
+                if mimetypes.guess_type(filename)[0] in ('image/jpeg', 'image/png'):
+                    self._thumbnail(filename)
+
+    def _thumbnail(self, filename):
+        """Return (directory, filename) of the thumbnail, rebuilding it if the original image is newer."""
+        source = os.path.join(self.directory, filename)
+        target_dir = os.path.join(self.thumbnail_dir, str(self.thumbnail_height))
+        target = os.path.join(target_dir, filename)
+        if not os.path.exists(target) or os.stat(target).st_mtime_ns < os.stat(source).st_mtime_ns:
+            os.makedirs(target_dir, exist_ok=True)
+            from PIL import Image
+            with Image.open(source) as image:
+                width = round(image.width * self.thumbnail_height / image.height)
+                image.thumbnail((width, self.thumbnail_height))
+                tmp = f'{target}.{os.getpid()}.tmp'
+                image.save(tmp, format=image.format, quality=85)
+            os.replace(tmp, target)
+        return target_dir, filename
+
+    def _serve(self, filename):
+        directory = self.directory
+        source = safe_join(self.directory, filename)  # None if filename tries to leave the directory
+        if source is None or not os.path.isfile(source):
+            flask.abort(404)
+        if self.thumbnail_height is not None:
+            directory, filename = self._thumbnail(filename)
+        # send_from_directory checks the path, and sets ETag and Last-Modified (If-None-Match/If-Modified-Since -> 304)
+        response = flask.send_from_directory(directory, filename, conditional=True)
+        response.cache_control.no_cache = None  # Set by recent Flask versions when no max_age is given
+        response.cache_control.private = True  # The route is behind the dashboard login: no shared proxy caches
+        response.cache_control.max_age = 365 * 24 * 3600  # The URL changes with the mtime (see url)
+        return response
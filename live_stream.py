@@ -0,0 +1,55 @@
+# Append-only data source for the live chart of the dashboard.
+# The samples are rows of a SQLite table (id, t, value) that the dashboard tails: every Interval tick asks for the rows
+# after the cursor (the last id) of the browser session, so a tick only sends the new points to the browser
+# (dcc.Graph extendData), not the whole history. Run `python live_stream.py` to append a random walk for testing.
+import os
+import sqlite3
+import threading
+import time
+
+import numpy as np
+
+SCHEMA = 'CREATE TABLE IF NOT EXISTS samples (id INTEGER PRIMARY KEY AUTOINCREMENT, t REAL NOT NULL, value REAL)'
+
+
+class SQLiteSource:
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()  # sqlite3 connections cannot be shared between threads
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with sqlite3.connect(path) as connection:
+            connection.execute('PRAGMA journal_mode=WAL')  # The writer does not block the readers
+            connection.execute(SCHEMA)
+
+    def _connection(self):
+        if getattr(self._local, 'connection', None) is None:
+            self._local.connection = sqlite3.connect(self.path)
+        return self._local.connection
+
+    def append(self, values, t=None):
+        """Append the samples 'values' (t: their unix times, now by default)."""
+        t = [time.time()] * len(values) if t is None else t
+        with self._connection() as connection:
+            connection.executemany('INSERT INTO samples (t, value) VALUES (?, ?)', zip(t, values))
+
+    def read_after(self, cursor, limit):
+        """Return (new cursor, times in ms, values) of the rows after the id 'cursor' (None: new session).
+
+        Only the last 'limit' of them are returned: the chart keeps no more points anyway.
+        """
+        rows = self._connection().execute('SELECT id, t, value FROM samples WHERE id > ? ORDER BY id DESC LIMIT ?',
+                                          (cursor or 0, limit)).fetchall()[::-1]
+        if not rows:
+            return cursor, [], []
+        ids, t, values = zip(*rows)
+        return ids[-1], [round(v * 1000) for v in t], list(values)  # ms since epoch: read as dates by plotly
+
+
+if __name__ == '__main__':
+    # Append a random walk sample every second
+    source = SQLiteSource('data/live.sqlite')
+    value = 0.0
+    while True:
+        value += np.random.randn()
+        source.append([value])
+        time.sleep(1)
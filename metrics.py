@@ -0,0 +1,141 @@
+# Timing and payload instrumentation of the Dash callbacks.
+# Use metrics.callback(...) instead of app.callback(...): for every callback it records the number of calls, the wall
+# time (total and histogram), the time of each phase marked with `with metrics.phase('filter'):` and the size of the
+# serialized response. The numbers are served in the Prometheus text format on /metrics, and every callback response
+# gets a Server-Timing header, so they also show up in the Network tab of the browser devtools.
+# The counters live in the memory of each process: with several workers, each one reports its own numbers.
+import contextvars
+import functools
+import hmac
+import threading
+import time
+from contextlib import contextmanager
+
+import flask
+from dash.exceptions import PreventUpdate
+
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, float('inf'))  # Histogram buckets (seconds)
+_current = contextvars.ContextVar('current_callback', default=None)  # Phase durations of the running callback
+
+
+class _Stats:
+    def __init__(self, output):
+        self.output = output
+        self.calls = 0
+        self.errors = 0
+        self.prevented = 0
+        self.seconds = 0.0
+        self.buckets = [0] * len(BUCKETS)
+        self.phase_seconds = {}
+        self.response_bytes = 0
+
+
+class CallbackMetrics:
+    def __init__(self, app, endpoint='/metrics', token=None):
+        self.app = app
+        self.token = token  # If set, /metrics requires the header 'Authorization: Bearer <token>'
+        self._stats = {}  # callback name -> _Stats
+        self._lock = threading.Lock()
+        app.server.add_url_rule(endpoint, 'callback_metrics', self._serve)
+        app.server.after_request(self._after_request)
+
+    def callback(self, *args, **kwargs):
+        """Same arguments as app.callback, with timing of the decorated function."""
+        output = args[0] if args else kwargs.get('output')
+        output = ', '.join(str(o) for o in output) if isinstance(output, (list, tuple)) else str(output)
+
+        def decorator(function):
+            @functools.wraps(function)
+            def timed(*callback_args):
+                phases = {}
+                token = _current.set(phases)
+                start = time.perf_counter()
+                status = 'ok'
+                try:
+                    return function(*callback_args)
+                except PreventUpdate:
+                    status = 'prevented'
+                    raise
+                except Exception:
+                    status = 'error'
+                    raise
+                finally:
+                    _current.reset(token)
+                    elapsed = time.perf_counter() - start
+                    self._record(function.__name__, output, elapsed, phases, status)
+                    if flask.has_request_context():  # Used by _after_request for the size and Server-Timing
+                        flask.g.callback_timing = (function.__name__, elapsed, phases)
+            return self.app.callback(*args, **kwargs)(timed)
+        return decorator
+
+    @contextmanager
+    def phase(self, name):
+        """Add the duration of the block to the phase 'name' of the running callback (e.g. 'filter', 'figure')."""
+        phases = _current.get()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            if phases is not None:
+                phases[name] = phases.get(name, 0.0) + time.perf_counter() - start
+
+    def _record(self, name, output, elapsed, phases, status):
+        with self._lock:
+            stats = self._stats.setdefault(name, _Stats(output))
+            stats.calls += 1
+            stats.errors += status == 'error'
+            stats.prevented += status == 'prevented'
+            stats.seconds += elapsed
+            for i, bound in enumerate(BUCKETS):
+                if elapsed <= bound:
+                    stats.buckets[i] += 1
+            for phase, seconds in phases.items():
+                stats.phase_seconds[phase] = stats.phase_seconds.get(phase, 0.0) + seconds
+
+    def _after_request(self, response):
+        timing = flask.g.pop('callback_timing', None)
+        if timing is None:
+            return response
+        name, elapsed, phases = timing
+        if not response.direct_passthrough:  # Streamed responses have no known size
+            with self._lock:
+                self._stats[name].response_bytes += response.calculate_content_length() or 0
+        entries = [f'callback;desc="{name}";dur={elapsed * 1000:.2f}']
+        entries += [f'{phase};dur={seconds * 1000:.2f}' for phase, seconds in phases.items()]
+        response.headers.add('Server-Timing', ', '.join(entries))
+        return response
+
+    def _serve(self):
+        if self.token is not None:
+            header = flask.request.headers.get('Authorization', '')
+            if not hmac.compare_digest(header.encode(), f'Bearer {self.token}'.encode()):
+                return flask.Response('Invalid metrics token\n', 401, {'WWW-Authenticate': 'Bearer'})
+        lines = []
+
+        def metric(name, kind, help_text):
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} {kind}')
+        with self._lock:
+            stats = sorted(self._stats.items())
+            metric('dash_callback_calls_total', 'counter', 'Number of calls of the callback.')
+            for name, s in stats:
+                for status, count in (('ok', s.calls - s.errors - s.prevented), ('prevented', s.prevented),
+                                      ('error', s.errors)):
+                    lines.append(f'dash_callback_calls_total{{callback="{name}",output="{s.output}",'
+                                 f'status="{status}"}} {count}')
+            metric('dash_callback_duration_seconds', 'histogram', 'Wall time of the callback.')
+            for name, s in stats:
+                for bound, count in zip(BUCKETS, s.buckets):
+                    le = '+Inf' if bound == float('inf') else repr(bound)
+                    lines.append(f'dash_callback_duration_seconds_bucket{{callback="{name}",le="{le}"}} {count}')
+                lines.append(f'dash_callback_duration_seconds_sum{{callback="{name}"}} {s.seconds:.6f}')
+                lines.append(f'dash_callback_duration_seconds_count{{callback="{name}"}} {s.calls}')
+            metric('dash_callback_phase_seconds_total', 'counter', 'Time spent in each phase of the callback.')
+            for name, s in stats:
+                for phase, seconds in sorted(s.phase_seconds.items()):
+                    lines.append(f'dash_callback_phase_seconds_total{{callback="{name}",phase="{phase}"}} '
+                                 f'{seconds:.6f}')
+            metric('dash_callback_response_bytes_total', 'counter', 'Size of the serialized callback responses.')
+            for name, s in stats:
+                lines.append(f'dash_callback_response_bytes_total{{callback="{name}"}} {s.response_bytes}')
+        return flask.Response('\n'.join(lines) + '\n', mimetype='text/plain; version=0.0.4')
@@ -0,0 +1,81 @@
+# Server-side engine for the Box/Lasso selections of a scatter plot.
+# The points are sorted by x once, so that a selection only tests the points of its x interval (two binary searches)
+# instead of all of them. Lasso selections use a vectorized point-in-polygon test and the shoelace polygon area, so
+# counts and densities are exact whatever the shape, and do not depend on the (possibly downsampled) points that the
+# browser sends back in selectedData.
+import numpy as np
+
+
+def polygon_area(xs, ys):
+    """Area of the polygon with vertices (xs, ys) (shoelace formula, the polygon is closed automatically)."""
+    xs = np.asarray(xs, dtype=float)
+    ys = np.asarray(ys, dtype=float)
+    return 0.5 * abs(np.dot(xs, np.roll(ys, -1)) - np.dot(ys, np.roll(xs, -1)))
+
+
+def points_in_polygon(px, py, xs, ys):
+    """Boolean mask of the points (px, py) inside the polygon (xs, ys) (even-odd ray casting).
+
+    The points are sorted by y, so each edge only tests the points of its own y span (a slice): the total work is
+    about the number of points times the number of edges crossed by a horizontal line, not times all the edges.
+    """
+    px = np.asarray(px, dtype=float)
+    py = np.asarray(py, dtype=float)
+    order = np.argsort(py, kind='stable')
+    sorted_x, sorted_y = px[order], py[order]
+    inside = np.zeros(len(px), dtype=bool)
+    for x1, y1, x2, y2 in zip(xs, ys, np.roll(xs, 1), np.roll(ys, 1)):  # Edge from vertex i-1 to vertex i
+        if y1 == y2:
+            continue  # A horizontal edge is never crossed by a horizontal ray
+        # The ray of a point crosses the y span of the edge if min(y1, y2) <= y < max(y1, y2)
+        start = np.searchsorted(sorted_y, min(y1, y2), side='left')
+        stop = np.searchsorted(sorted_y, max(y1, y2), side='left')
+        x_cross = (x2 - x1) * (sorted_y[start:stop] - y1) / (y2 - y1) + x1
+        inside[start:stop] ^= sorted_x[start:stop] < x_cross
+    mask = np.empty(len(px), dtype=bool)
+    mask[order] = inside
+    return mask
+
+
+class SelectionEngine:
+    def __init__(self, x, y):
+        order = np.argsort(np.asarray(x, dtype=float), kind='stable')
+        self.x = np.asarray(x, dtype=float)[order]
+        self.y = np.asarray(y, dtype=float)[order]
+
+    def _x_slice(self, x0, x1):
+        return slice(np.searchsorted(self.x, min(x0, x1), side='left'),
+                     np.searchsorted(self.x, max(x0, x1), side='right'))
+
+    def select_box(self, x_range, y_range):
+        """Return (x, y) of the points inside the rectangle, and its area."""
+        rows = self._x_slice(*x_range)
+        x, y = self.x[rows], self.y[rows]
+        mask = (y >= min(y_range)) & (y <= max(y_range))
+        area = abs(x_range[1] - x_range[0]) * abs(y_range[1] - y_range[0])
+        return x[mask], y[mask], area
+
+    def select_lasso(self, xs, ys):
+        """Return (x, y) of the points inside the lasso polygon, and its area."""
+        rows = self._x_slice(min(xs), max(xs))
+        x, y = self.x[rows], self.y[rows]
+        candidates = (y >= min(ys)) & (y <= max(ys))  # Bounding box first: cheap, and usually most of the work
+        x, y = x[candidates], y[candidates]
+        mask = points_in_polygon(x, y, xs, ys)
+        return x[mask], y[mask], polygon_area(xs, ys)
+
+    def summarize(self, selected_data):
+        """Summary of a selectedData dict of a Graph: count, area, density (None if the area is 0), means and
+        ranges of the selected points. None if there is no Box/Lasso in selected_data."""
+        if selected_data.get('range'):
+            x, y, area = self.select_box(selected_data['range']['x'], selected_data['range']['y'])
+        elif selected_data.get('lassoPoints'):
+            x, y, area = self.select_lasso(selected_data['lassoPoints']['x'], selected_data['lassoPoints']['y'])
+        else:
+            return None
+        count = len(x)
+        summary = {'count': count, 'area': area, 'density': count / area if area > 0 else None}
+        if count:
+            summary.update(mean_x=x.mean(), mean_y=y.mean(), min_x=x.min(), max_x=x.max(), min_y=y.min(),
+                           max_y=y.max())
+        return summary
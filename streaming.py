@@ -0,0 +1,46 @@
+# One-pass aggregations over the chunks of data_loader.iter_chunks.
+# Each function keeps only what the figure needs (bin counts, a fixed-size sample, ...) while the chunks go by: the
+# memory is bounded by the chunk size and the result size, not by the number of rows of the file.
+import numpy as np
+import pandas as pd
+
+
+def histogram_counts(chunks, column, start, end, size):
+    """Counts of the bins [start, start + size), ... up to end, as plotly's histogram xbins. Returns (left edges,
+    counts). The values outside [start, end) and the missing values are not counted."""
+    n_bins = int(np.ceil((end - start) / size))
+    counts = np.zeros(n_bins, dtype=np.int64)
+    for chunk in chunks:
+        values = chunk[column].to_numpy(dtype=float)
+        values = values[(values >= start) & (values < start + n_bins * size)]  # NaN compares False: dropped
+        counts += np.bincount(((values - start) // size).astype(np.int64), minlength=n_bins)[:n_bins]
+    return start + size * np.arange(n_bins), counts
+
+
+def reservoir_samples(chunks, column, sizes, seed=None):
+    """Uniform samples without replacement of the values of column, one sample per size in sizes, in one pass.
+
+    Every row gets a random key per sample, and each sample keeps the rows with the smallest keys seen so far (a
+    reservoir of 'size' values): the same distribution as np.random.choice(values, size, replace=False).
+    """
+    rng = np.random.default_rng(seed)
+    reservoirs = [(np.empty(0), None) for _ in sizes]  # (keys, values) of every sample, values with the column dtype
+    for chunk in chunks:
+        values = chunk[column].to_numpy()
+        for i, size in enumerate(sizes):
+            keys = np.concatenate([reservoirs[i][0], rng.random(len(values))])
+            candidates = values if reservoirs[i][1] is None else np.concatenate([reservoirs[i][1], values])
+            if len(keys) > size:
+                keep = np.argpartition(keys, size - 1)[:size]
+                keys, candidates = keys[keep], candidates[keep]
+            reservoirs[i] = keys, candidates
+    for size, (keys, _) in zip(sizes, reservoirs):
+        if len(keys) < size:
+            raise ValueError(f'Cannot take a sample of {size} values from {len(keys)} rows')
+    return [values for _, values in reservoirs]
+
+
+def filter_rows(chunks, mask):
+    """Concatenation of the rows of the chunks where mask(chunk) is True (for selections much smaller than the file)."""
+    parts = [chunk[mask(chunk)] for chunk in chunks]
+    return pd.concat(parts) if parts else pd.DataFrame()
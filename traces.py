@@ -0,0 +1,145 @@
+# Size-aware trace factory for the scatter plots of the dashboard.
+# Small traces are plain SVG scatter traces, exactly as before. Above WEBGL_THRESHOLD points the trace becomes a WebGL
+# scattergl, restricted to the zoomed window (from the graph's relayoutData) and downsampled on the server:
+# LTTB (Largest Triangle Three Buckets) for lines, grid binning for markers. The payload sent to the browser is then
+# bounded by MAX_POINTS, whatever the number of rows.
+# The traces are plain dicts, not go.Scatter objects: the callbacks skip the plotly validation (and its deep copies)
+# at every call. The numeric arrays stay contiguous NumPy arrays, that the orjson engine of plotly.io (used by Dash
+# when orjson is installed) writes directly, without converting them to lists. validate_figure checks the dicts
+# against the plotly schema, once (see benchmark.py) instead of at every call.
+import numpy as np
+import plotly.graph_objs as go
+
+WEBGL_THRESHOLD = 20000  # Above this number of points: Scattergl + downsampling
+MAX_POINTS = 5000  # Maximum number of points of a downsampled trace
+
+
+def axis_window(relayout_data):
+    """Return the zoomed ranges (x0, x1, y0, y1) found in a relayoutData dict (None where the axis is not zoomed)."""
+    window = [None, None, None, None]
+    if not relayout_data:
+        return tuple(window)
+    for i, axis in enumerate(('xaxis', 'yaxis')):
+        if relayout_data.get(axis + '.autorange'):  # Double click: back to the full range
+            continue
+        if axis + '.range' in relayout_data:
+            window[2 * i:2 * i + 2] = relayout_data[axis + '.range']
+        elif axis + '.range[0]' in relayout_data:
+            window[2 * i:2 * i + 2] = relayout_data[axis + '.range[0]'], relayout_data[axis + '.range[1]']
+    return tuple(window)
+
+
+def lttb(x, y, n_out):
+    """Indices of the n_out points kept by the Largest Triangle Three Buckets algorithm (x must be sorted)."""
+    n = len(x)
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+    edges = np.linspace(1, n - 1, n_out - 1).astype(int)  # n_out - 2 buckets between the first and the last point
+    # Average point of every bucket, used as the third vertex of the triangle of the previous bucket
+    sums_x = np.add.reduceat(x[1:n - 1], edges[:-1] - 1)
+    sums_y = np.add.reduceat(y[1:n - 1], edges[:-1] - 1)
+    counts = np.diff(edges)
+    avg_x = np.append(sums_x / counts, x[-1])
+    avg_y = np.append(sums_y / counts, y[-1])
+    keep = np.empty(n_out, dtype=int)
+    keep[0], keep[-1] = 0, n - 1
+    for b in range(n_out - 2):
+        start, stop = edges[b], edges[b + 1]
+        ax, ay = x[keep[b]], y[keep[b]]
+        areas = np.abs((ax - avg_x[b + 1]) * (y[start:stop] - ay) - (ax - x[start:stop]) * (avg_y[b + 1] - ay))
+        keep[b + 1] = start + np.argmax(areas)
+    return keep
+
+
+def grid_sample(x, y, n_out):
+    """Indices of one point per occupied cell of a ~sqrt(n_out) x sqrt(n_out) grid (keeps outliers and shape)."""
+    n = len(x)
+    if n_out >= n:
+        return np.arange(n)
+    side = max(1, int(np.sqrt(n_out)))
+    cells = []
+    for values in (x, y):
+        low, high = np.nanmin(values), np.nanmax(values)
+        span = (high - low) or 1.0
+        cells.append(np.minimum(((values - low) / span * side).astype(int), side - 1))
+    _, first = np.unique(cells[0] * side + cells[1], return_index=True)
+    return np.sort(first)
+
+
+def _select(value, keep, n):
+    """Apply the kept indices to the per-point arrays of the trace arguments (text, marker.size, ...)."""
+    if isinstance(value, dict):
+        return {key: _select(item, keep, n) for key, item in value.items()}
+    if not isinstance(value, (str, bytes)) and hasattr(value, '__len__') and len(value) == n:
+        return np.asarray(value)[keep]
+    return value
+
+
+def plain_array(values):
+    """values as the JSON encoder writes them fastest: a contiguous array if numeric, a list of strings otherwise."""
+    values = np.asarray(values)
+    if values.dtype.kind in 'biuf':
+        return np.ascontiguousarray(values)
+    if values.dtype.kind == 'M':
+        return np.datetime_as_string(values).tolist()
+    return values.tolist()
+
+
+def _plain(value):
+    if isinstance(value, dict):
+        return {key: _plain(item) for key, item in value.items()}
+    if not isinstance(value, (str, bytes)) and hasattr(value, '__len__'):
+        return plain_array(value)
+    return value
+
+
+def plain_trace(trace_type, **props):
+    """A trace of type trace_type ('scatter', 'bar', ...) as a plain dict, with its per-point arrays as plain_array."""
+    return {'type': trace_type, **_plain(props)}
+
+
+def validate_figure(figure):
+    """Check a plain-dict figure against the plotly schema (ValueError if a property is invalid)."""
+    return go.Figure(figure)
+
+
+def needs_downsampling(n_points, threshold=WEBGL_THRESHOLD):
+    return n_points > threshold
+
+
+def scatter_trace(x, y, mode='markers', window=None, log_x=False, threshold=WEBGL_THRESHOLD, max_points=MAX_POINTS,
+                  **kwargs):
+    """Return a scatter trace (plain dict), or a downsampled scattergl if there are more than 'threshold' points.
+
+    window is the zoomed (x0, x1, y0, y1) returned by axis_window: only the points inside it are kept.
+    When the points are downsampled, customdata holds the row number of every point (unless customdata is given),
+    so that hover/click callbacks can find the original row.
+    """
+    n = len(x)
+    if not needs_downsampling(n, threshold):
+        return plain_trace('scatter', x=x, y=y, mode=mode, **kwargs)
+    x = np.asarray(x)
+    y = np.asarray(y)
+    kwargs.setdefault('customdata', np.arange(n))
+    keep = np.arange(n)
+    if x.dtype.kind in 'iuf' and y.dtype.kind in 'iuf':
+        x0, x1, y0, y1 = window or (None, None, None, None)
+        in_window = np.ones(n, dtype=bool)
+        if x0 is not None:
+            if log_x:  # The range of a log axis is in log10 units
+                x0, x1 = 10 ** x0, 10 ** x1
+            in_window &= (x >= min(x0, x1)) & (x <= max(x0, x1))
+        if y0 is not None and 'lines' not in mode:  # Lines still need the points outside of the y range
+            in_window &= (y >= min(y0, y1)) & (y <= max(y0, y1))
+        keep = np.flatnonzero(in_window)
+        xs = np.log10(x[keep]) if log_x else x[keep]
+        if 'lines' in mode:  # lttb works on buckets of consecutive x: the points must be sorted by x first
+            order = np.argsort(xs, kind='stable')
+            keep, xs = keep[order], xs[order]
+            keep = keep[lttb(xs.astype(float), y[keep].astype(float), max_points)]
+        else:
+            keep = keep[grid_sample(xs, y[keep], max_points)]
+    elif n > max_points:  # Non numeric axis: keep evenly spaced points
+        keep = np.linspace(0, n - 1, max_points).astype(int)
+    kwargs = _select(kwargs, keep, n)
+    return plain_trace('scattergl', x=x[keep], y=y[keep], mode=mode, **kwargs)
@@ -0,0 +1,28 @@
+# Production entry point of the dashboard (1_dash_00.py) for a multi-process WSGI server:
+#   gunicorn -c gunicorn.conf.py
+# gunicorn.conf.py sets preload_app, so this module (and with it every DataFrame of the dashboard) is loaded once in
+# the master process before the workers are forked: the workers share those memory pages (copy-on-write) instead of
+# each loading its own copy. The workers share the figures they build through the file cache of 1_dash_00.py.
+import gc
+import importlib.util
+import os
+import shutil
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+os.chdir(ROOT)  # The dashboard uses paths relative to the repo
+from figure_cache import FIGURE_DIR  # noqa: E402
+
+# The prebuilt static figures may come from other module-level data (e.g. the random dfx): rebuilt by the import
+shutil.rmtree(FIGURE_DIR, ignore_errors=True)
+
+spec = importlib.util.spec_from_file_location('dash_app', os.path.join(ROOT, '1_dash_00.py'))
+dash_app = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(dash_app)
+
+if dash_app.Cache is not None:
+    dash_app.cache.clear()  # Results of a previous deployment may come from other data or code
+app = dash_app.app
+server = app.server  # The WSGI application
+# Move the objects loaded so far out of the garbage collector's reach: collections in the workers would otherwise
+# write to (and so copy) the shared pages.
+gc.freeze()